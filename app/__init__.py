@@ -1,8 +1,13 @@
 from flask import Flask, render_template
-from config import Config
+from config import Config, validate_config
 import logging
+import time
+import sys
 import os
 
+# 按需加载的重型依赖：启动时不导入，首次打开PDF或发送请求时才加载
+DEFERRED_MODULES = ('fitz', 'requests', 'httpx')
+
 def create_app(config_class=Config):
     """
     Flask应用工厂函数
@@ -13,7 +18,13 @@ def create_app(config_class=Config):
     
     Returns:
         配置完成的Flask应用实例
+    
+    Raises:
+        ValueError: 配置有误（例如未设置 API_KEY）时，应用无法启动
     """
+    started = time.perf_counter()
+    phases = {}
+    
     # 获取当前文件的绝对路径，用于确定模板目录位置
     current_dir = os.path.dirname(os.path.abspath(__file__))
     # 指定模板目录为 app/templates
@@ -38,8 +49,11 @@ def create_app(config_class=Config):
     else:
         print(f"Template file not found at: {template_file}")
     
-    # 从配置类加载配置
+    # 从配置类加载配置，并在启动时检查（而不是导入 config 时）
+    phase_started = time.perf_counter()
     app.config.from_object(config_class)
+    validate_config(app.config)
+    phases['config'] = time.perf_counter() - phase_started
 
     # 确保上传和输出目录存在
     # uploads/: 存储上传的PDF文件
@@ -58,9 +72,16 @@ def create_app(config_class=Config):
     logger.addHandler(file_handler)
 
     # 注册蓝图，将不同功能模块的路由注册到应用
-    from app.routes import chat_bp, pdf_bp
+    phase_started = time.perf_counter()
+    from app.routes import chat_bp, pdf_bp, search_bp, debug_bp, trace_bp
     app.register_blueprint(chat_bp)
     app.register_blueprint(pdf_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(trace_bp)
+    # 性能排查接口和请求采样钩子默认不注册，正常请求没有额外开销
+    if app.config.get('PROFILING_ENABLED'):
+        app.register_blueprint(debug_bp)
+    phases['blueprints'] = time.perf_counter() - phase_started
 
     # 添加根路由，处理主页访问
     # 在前端请求 '/' 时调用
@@ -74,4 +95,14 @@ def create_app(config_class=Config):
             print(f"Template folders: {app.jinja_loader.searchpath}")
             raise
 
+    # 启动耗时报告：记录到日志，并通过 /scheduler-stats 的 startup 字段查看
+    app.extensions['startup_report'] = {
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        'deferred_modules': [name for name in DEFERRED_MODULES if name not in sys.modules]
+    }
+    logger.info(f"App created in {app.extensions['startup_report']['total_ms']} ms "
+                f"(phases: {app.extensions['startup_report']['phases_ms']}, "
+                f"not yet loaded: {app.extensions['startup_report']['deferred_modules']})")
+
     return app 
\ No newline at end of file
@@ -16,6 +16,8 @@ DEFAULT_PROMPTS = [
     }
 ]
 
+# 提示模板可带可选字段 model_tier（fast/large/auto）和 max_tokens，
+# 覆盖该提示的模型路由（见 app/services/model_router.py）
 PDF_PROMPTS = [
     {
         "id": 1,
@@ -53,4 +55,20 @@ PDF_PROMPTS = [
     "prompt": "请将这段内容转换为结构化的学习笔记，使用markdown格式，包含标题、小标题、要点和示例。1.简明扼要：\n2.层次分明：使用标题、副标题和缩进来清晰区分主要内容和次要细节。\n3.重点强调：（注意！：重要概念、关键术语和核心公式使用中英双语，英文在前，中文写在括号里！括号！尤其是定义与关键点，那些名词请用英文！也别忘了中文！）\n4.互动性和反思：注意！反思要有相应回答！\n5.便于复习：注意！不得丢失重要细节信息。尤其是可能被出成考题的！\n6.‘’同时，给出足够多的联想与解决。不能光秃秃的列举。\n7.每一页内容处理成一个小章节"
     }
 
-] 
\ No newline at end of file
+] 
+# 聊天上下文滚动摘要使用的提示
+CHAT_SUMMARY_PROMPT = """你负责维护一段对话的滚动摘要。下面给出已有摘要（可能为空）和之后新增的对话，
+请输出更新后的完整摘要：
+1. 保留用户的目标、已确认的事实、结论和尚未解决的问题
+2. 省略寒暄和重复内容
+3. 使用简洁的要点列表，总长度不超过300字"""
+
+# 整篇文档汇总时合并各部分结果使用的提示，{prompt} 为用户选择的处理提示
+DOC_REDUCE_PROMPT = """下面是按同一处理要求对一份文档的各个连续部分分别处理得到的结果（按页码顺序排列）。
+处理要求是：
+{prompt}
+
+请把这些部分结果合并为一份完整的结果，仍然满足上述处理要求：
+1. 合并重复内容，保留各部分的关键信息和细节
+2. 按文档原有顺序组织结构
+3. 直接输出合并后的结果，不要说明合并过程"""
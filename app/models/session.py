@@ -1,14 +1,218 @@
+import os
+import json
+import bisect
+import logging
+import threading
 from collections import deque
 from datetime import datetime
+from flask import current_app
 
-# 使用deque限制历史记录数量
-chat_history = deque(maxlen=100)
-
-def add_to_history(role, content, tokens_used=0):
-    """添加消息到聊天历史"""
-    chat_history.append({
-        'role': role,
-        'content': content,
-        'tokens_used': tokens_used,
-        'timestamp': datetime.now().isoformat()
-    }) 
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+class ChatStore:
+    """
+    聊天记录存储
+    用途：按用户分别保存聊天记录，追加写入磁盘，重启后仍可恢复
+
+    存储格式（每个用户两个文件）：
+    - <user_id>.jsonl: 追加写入的消息，每行一条，带递增的 seq
+    - <user_id>.state.json: 下一个消息序号、滚动摘要状态和导出进度
+
+    内存中只缓存每个用户最近 max_cached 条消息，以及每条消息的序号和在文件中的偏移量，
+    分页读取更早的消息时直接按偏移量读取文件
+
+    被调用位置：
+    - app/routes/chat.py: 记录、分页查询和导出聊天记录
+    """
+
+    def __init__(self, folder, max_cached=100):
+        """
+        初始化聊天记录存储
+
+        Args:
+            folder: 存储目录
+            max_cached: 每个用户在内存中缓存的最近消息数
+        """
+        self.folder = folder
+        self.max_cached = max_cached
+        self._users = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _paths(self, user_id):
+        """返回用户的消息文件和状态文件路径"""
+        safe_id = ''.join(c for c in user_id if c.isalnum() or c in '-_')
+        base = os.path.join(self.folder, safe_id)
+        return f"{base}.jsonl", f"{base}.state.json"
+
+    def _user(self, user_id):
+        """获取（必要时从磁盘加载）用户的缓存数据"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                return user
+
+            messages_path, state_path = self._paths(user_id)
+            user = {
+                'lock': threading.Lock(),
+                'recent': deque(maxlen=self.max_cached),
+                'offsets': [],
+                'seqs': [],  # 与 offsets 一一对应的消息序号，递增
+                'state': {'next_seq': 1, 'summary': {'upto_seq': 0, 'text': ''}, 'export': None}
+            }
+            if os.path.exists(state_path):
+                with open(state_path, 'r', encoding='utf-8') as f:
+                    user['state'].update(json.load(f))
+            if os.path.exists(messages_path):
+                self._load_messages(messages_path, user)
+                if user['recent']:
+                    user['state']['next_seq'] = max(user['state']['next_seq'], user['recent'][-1]['seq'] + 1)
+            self._users[user_id] = user
+            return user
+
+    def _load_messages(self, messages_path, user):
+        """
+        读取消息文件，记录每条消息的序号和偏移量并缓存最近的消息
+
+        进程在追加中途退出时最后一行可能不完整：截掉该行，之后的追加从完整的行之后开始；
+        其他无法解析的行跳过，不计入偏移量
+        """
+        with open(messages_path, 'rb') as f:
+            lines = f.readlines()
+        offset = 0
+        for number, line in enumerate(lines):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                if number == len(lines) - 1:
+                    logger.warning(f"Truncating incomplete last line of {messages_path}")
+                    with open(messages_path, 'r+b') as f:
+                        f.truncate(offset)
+                    break
+                logger.warning(f"Skipping unreadable line {number + 1} of {messages_path}")
+            else:
+                user['offsets'].append(offset)
+                user['seqs'].append(message['seq'])
+                user['recent'].append(message)
+            offset += len(line)
+
+    def _save_state(self, user_id, state):
+        """原子写入用户状态文件"""
+        _, state_path = self._paths(user_id)
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, state_path)
+
+    def append(self, user_id, role, content, tokens_used=0):
+        """
+        追加一条消息
+
+        Returns:
+            dict: 写入的消息
+        """
+        user = self._user(user_id)
+        messages_path, _ = self._paths(user_id)
+        with user['lock']:
+            message = {
+                'seq': user['state']['next_seq'],
+                'role': role,
+                'content': content,
+                'tokens_used': tokens_used,
+                'timestamp': datetime.now().isoformat()
+            }
+            line = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+            with open(messages_path, 'ab') as f:
+                user['offsets'].append(f.tell())
+                f.write(line)
+            user['seqs'].append(message['seq'])
+            user['recent'].append(message)
+            user['state']['next_seq'] += 1
+            self._save_state(user_id, user['state'])
+            return message
+
+    def recent(self, user_id):
+        """返回内存中缓存的最近消息（按时间顺序）"""
+        return list(self._user(user_id)['recent'])
+
+    def count(self, user_id):
+        """返回用户的消息总数"""
+        return len(self._user(user_id)['offsets'])
+
+    def _read_range(self, user_id, start, end):
+        """按下标范围 [start, end) 从文件读取消息"""
+        user = self._user(user_id)
+        messages_path, _ = self._paths(user_id)
+        if start >= end:
+            return []
+        messages = []
+        with open(messages_path, 'rb') as f:
+            # 按偏移量逐条读取，跳过的无法解析的行不会错位
+            for offset in user['offsets'][start:end]:
+                f.seek(offset)
+                messages.append(json.loads(f.readline()))
+        return messages
+
+    def page(self, user_id, page=1, per_page=50):
+        """
+        分页读取消息，第1页为最新的消息，每页内部按时间顺序排列
+
+        Returns:
+            dict: 包含 messages、page、per_page、total、has_more
+        """
+        total = self.count(user_id)
+        end = max(total - (page - 1) * per_page, 0)
+        start = max(end - per_page, 0)
+        return {
+            'messages': self._read_range(user_id, start, end),
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'has_more': start > 0
+        }
+
+    def messages_after(self, user_id, seq):
+        """读取序号大于 seq 的所有消息"""
+        user = self._user(user_id)
+        # 按记录的序号查找，跳过无法解析的行后下标和序号不再对应
+        start = bisect.bisect_right(user['seqs'], seq)
+        return self._read_range(user_id, start, len(user['offsets']))
+
+    def get_summary(self, user_id):
+        """返回用户的滚动摘要状态（可原地修改后调用 save_summary 保存）"""
+        return dict(self._user(user_id)['state']['summary'])
+
+    def save_summary(self, user_id, summary_state):
+        """保存用户的滚动摘要状态"""
+        user = self._user(user_id)
+        with user['lock']:
+            user['state']['summary'] = dict(summary_state)
+            self._save_state(user_id, user['state'])
+
+    def get_export(self, user_id):
+        """返回用户的导出进度：{'file': 导出文件路径, 'last_seq': 已导出的最后一条消息序号}"""
+        return self._user(user_id)['state'].get('export')
+
+    def save_export(self, user_id, export_state):
+        """保存用户的导出进度"""
+        user = self._user(user_id)
+        with user['lock']:
+            user['state']['export'] = export_state
+            self._save_state(user_id, user['state'])
+
+
+# 共享的聊天记录存储，首次使用时根据配置创建
+_chat_store = None
+_chat_store_lock = threading.Lock()
+
+def get_chat_store():
+    """获取共享的聊天记录存储"""
+    global _chat_store
+    with _chat_store_lock:
+        if _chat_store is None:
+            _chat_store = ChatStore(current_app.config.get('CHAT_STORE_FOLDER', os.path.join('uploads', 'chats')))
+        return _chat_store
+
+def add_to_history(user_id, role, content, tokens_used=0):
+    """添加消息到用户的聊天历史"""
+    return get_chat_store().append(user_id, role, content, tokens_used)
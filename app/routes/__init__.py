@@ -1,4 +1,7 @@
 from app.routes.chat import chat_bp
 from app.routes.pdf import pdf_bp
+from app.routes.search import search_bp
+from app.routes.debug import debug_bp
+from app.routes.traces import trace_bp
 
-__all__ = ['chat_bp', 'pdf_bp'] 
\ No newline at end of file
+__all__ = ['chat_bp', 'pdf_bp', 'search_bp', 'debug_bp', 'trace_bp']
\ No newline at end of file
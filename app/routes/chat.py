@@ -1,12 +1,18 @@
 from flask import Blueprint, jsonify, request, Response, current_app, session
 from app.services.ai_processor import AIProcessor
+from app.services.async_ai_processor import AsyncAIProcessor
+from app.services.scheduler import INTERACTIVE
+from app.services.retriever import BM25Retriever
+from app.services.chat_context import ChatContextBuilder
 from app.utils.file_handler import get_output_filename, append_to_markdown
-from app.models.session import chat_history, add_to_history
+from app.utils.text_utils import estimate_tokens
+from app.models.session import get_chat_store, add_to_history
 import os
 import json
+import uuid
 import logging
 from datetime import datetime
-from app.utils.prompt_manager import PromptManager
+from app.utils.prompt_manager import get_prompt_manager
 import traceback
 
 # 创建日志记录器
@@ -14,11 +20,58 @@ logger = logging.getLogger(__name__)
 
 chat_bp = Blueprint('chat', __name__)
 
-# 创建提示管理器实例
-prompt_manager = PromptManager()
+def _get_user_id():
+    """获取当前浏览器会话对应的用户ID，首次访问时分配"""
+    if 'user_id' not in session:
+        session['user_id'] = uuid.uuid4().hex
+    return session['user_id']
+
+def _build_retrieval_message(message, top_k=None):
+    """
+    从当前用户上传的PDF中检索相关页面片段，附加到问题前作为参考资料
+    
+    Args:
+        message: 用户问题
+        top_k: 最多引用的片段数，默认使用 CHAT_RETRIEVAL_TOP_K 配置
+    
+    Returns:
+        tuple: (发送给AI的消息, 引用列表, 参考资料估算token数)
+    """
+    file_paths = [path for path in session.get('uploaded_files', []) if os.path.exists(path)]
+    chunks = BM25Retriever().retrieve(
+        message,
+        file_paths,
+        top_k=top_k or current_app.config.get('CHAT_RETRIEVAL_TOP_K', 5),
+        token_budget=current_app.config.get('CHAT_RETRIEVAL_TOKEN_BUDGET', 3000)
+    )
+    if not chunks:
+        logger.info("检索模式未找到相关页面")
+        return message, [], 0
+    
+    references = "\n\n".join(
+        f"[{i}] {chunk['source_file']} 第{chunk['page_number']}页\n{chunk['text']}"
+        for i, chunk in enumerate(chunks, 1)
+    )
+    content = (
+        f"以下是从已上传PDF中检索到的参考资料：\n\n{references}\n\n"
+        f"问题：{message}\n\n"
+        "请依据参考资料回答，引用时用 [编号] 注明来源；参考资料不足以回答时请说明。"
+    )
+    citations = [
+        {
+            'index': i,
+            'source_file': chunk['source_file'],
+            'page_number': chunk['page_number'],
+            'score': chunk['score']
+        }
+        for i, chunk in enumerate(chunks, 1)
+    ]
+    context_tokens = sum(chunk['tokens'] for chunk in chunks)
+    logger.info(f"检索到 {len(chunks)} 个相关片段，约 {context_tokens} tokens")
+    return content, citations, context_tokens
 
 @chat_bp.route('/chat', methods=['POST'])
-def chat():
+async def chat():
     """处理聊天请求"""
     try:
         data = request.get_json()
@@ -30,9 +83,36 @@ def chat():
         
         current_prompt = session.get('current_prompt', "你是一个友好的AI助手，请用简洁专业的方式回答问题。")
         
-        processor = AIProcessor()
-        response = processor.process_text(message, current_prompt, is_chat=True)
-        
+        # 检索模式：只附加与问题相关的页面片段，而不是整页粘贴
+        citations, context_tokens = [], 0
+        model_message = message
+        if data.get('retrieval'):
+            model_message, citations, context_tokens = _build_retrieval_message(message, data.get('top_k'))
+        
+        user_id = _get_user_id()
+        processor = AsyncAIProcessor(priority=INTERACTIVE, session_key=user_id)
+        store = get_chat_store()
+        
+        # 在token预算内构建对话上下文：最近的对话原样发送，更早的对话以滚动摘要代替
+        summary_state = store.get_summary(user_id)
+        history, summary, context_stats = await ChatContextBuilder.from_config(current_app.config).build_async(
+            store.recent(user_id), summary_state, processor
+        )
+        if context_stats['summary_updated']:
+            store.save_summary(user_id, summary_state)
+        instruction = current_prompt
+        if summary:
+            instruction = f"{current_prompt}\n\n以下是之前对话的摘要：\n{summary}"
+        context_stats['prompt_tokens'] = (
+            estimate_tokens(instruction) + context_stats['history_tokens'] + estimate_tokens(model_message)
+        )
+        logger.info(f"本轮提示约 {context_stats['prompt_tokens']} tokens "
+                    f"(历史 {context_stats['recent_messages']} 条, 摘要 {context_stats['summary_tokens']} tokens)")
+        
+        response = await processor.process_text_async(model_message, instruction, is_chat=True, history=history)
+        
+        if response.get('unavailable'):
+            return jsonify(response), 503, {'Retry-After': str(response['retry_after'])}
         if 'error' in response:
             logger.error(f"处理消息时出错: {response['error']}")
             return jsonify({'error': response['error']}), 500
@@ -40,15 +120,20 @@ def chat():
         content = response['content']  # 不再尝试从 choices 中获取
         logger.info(f"AI回复: {content}")
         
-        # 添加消息到聊天历史
-        add_to_history('user', message)
-        add_to_history('assistant', content)
+        # 添加消息到聊天历史，记录本轮实际消耗的tokens
+        usage = response.get('usage', {})
+        add_to_history(user_id, 'user', message, usage.get('prompt_tokens', 0))
+        add_to_history(user_id, 'assistant', content, usage.get('completion_tokens', 0))
         
         logger.info("聊天历史已更新")
         logger.info("="*50)
         
         return jsonify({
-            'response': content
+            'response': content,
+            'citations': citations,
+            'context_tokens': context_tokens,
+            'context': context_stats,
+            'usage': usage
         })
         
     except Exception as e:
@@ -60,29 +145,53 @@ def chat():
 
 @chat_bp.route('/chat-history', methods=['GET'])
 def get_chat_history():
-    return jsonify(list(chat_history))
+    """分页获取当前用户的聊天历史，第1页为最新的消息"""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 200)
+        return jsonify(get_chat_store().page(_get_user_id(), page, per_page))
+    except Exception as e:
+        logger.error(f"Failed to get chat history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @chat_bp.route('/save-chat', methods=['POST'])
 def save_chat():
+    """导出聊天记录：首次导出创建文件，之后只追加上次导出后新增的消息"""
     try:
         # 确保输出目录存在
         output_dir = current_app.config.get('OUTPUT_FOLDER', 'output')
         os.makedirs(output_dir, exist_ok=True)
         
-        output_filename = get_output_filename("", is_chat=True)
-        output_path = os.path.join(output_dir, output_filename)
-        
-        chat_content = "# 聊天记录\n\n"
-        for msg in chat_history:
+        user_id = _get_user_id()
+        store = get_chat_store()
+        export = store.get_export(user_id)
+        
+        if export and os.path.exists(export['file']):
+            output_path = export['file']
+            chat_content = ""
+            create_new = False
+        else:
+            output_path = os.path.join(output_dir, get_output_filename("", is_chat=True))
+            export = {'file': output_path, 'last_seq': 0}
+            chat_content = "# 聊天记录\n\n"
+            create_new = True
+        
+        new_messages = store.messages_after(user_id, export['last_seq'])
+        for msg in new_messages:
             role = "用户" if msg["role"] == "user" else "AI助手"
             chat_content += f"### {role}\n\n{msg['content']}\n\n"
         
-        append_to_markdown(chat_content, output_path, True)
+        if chat_content:
+            append_to_markdown(chat_content, output_path, create_new)
+        if new_messages:
+            export['last_seq'] = new_messages[-1]['seq']
+        store.save_export(user_id, export)
         
         return jsonify({
             'success': True,
-            'output_file': output_filename,
-            'output_path': output_path
+            'output_file': os.path.basename(output_path),
+            'output_path': output_path,
+            'appended_messages': len(new_messages)
         })
     except Exception as e:
         logger.error(f"Failed to save chat: {str(e)}")
@@ -97,10 +206,12 @@ def test_api():
 
 @chat_bp.route('/prompts', methods=['GET'])
 def get_prompts():
-    """获取所有提示模板"""
+    """获取所有提示模板（ETag 为提示版本，提示未变化时对 If-None-Match 返回 304）"""
     try:
-        prompts = prompt_manager.get_all_prompts()
-        return jsonify(prompts)
+        prompt_manager = get_prompt_manager()
+        response = jsonify(prompt_manager.get_all_prompts())
+        response.set_etag(prompt_manager.version)
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Failed to get prompts: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -112,11 +223,8 @@ def update_prompt():
         data = request.get_json()
         prompt_id = data.get('promptId')
         
-        # 获取所有提示
-        prompts = prompt_manager.get_all_prompts()
-        
         # 查找选中的提示
-        selected_prompt = next((p for p in prompts if p['id'] == prompt_id), None)
+        selected_prompt = get_prompt_manager().get_prompt_by_id(prompt_id)
         if not selected_prompt:
             return jsonify({'error': 'Prompt not found'}), 404
             
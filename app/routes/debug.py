@@ -0,0 +1,123 @@
+from flask import Blueprint, jsonify, request, current_app, g, abort, send_from_directory
+from werkzeug.utils import secure_filename
+from app.services.profiler import SamplingProfiler, MemoryTracker
+import os
+import time
+import logging
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 性能排查接口，只在 PROFILING_ENABLED 为真时注册（见 app/__init__.py），
+# 未启用时请求钩子不存在，对正常请求没有任何开销
+debug_bp = Blueprint('debug', __name__, url_prefix='/debug')
+
+_memory_tracker = None
+
+def _profile_requested():
+    """请求是否要求采样分析（X-Profile 请求头或 profile 查询参数）"""
+    flag = request.headers.get('X-Profile') or request.args.get('profile')
+    return flag is not None and flag.lower() not in ('', '0', 'false')
+
+@debug_bp.before_app_request
+def start_profiler():
+    """按需对当前请求开始采样"""
+    if not _profile_requested() or request.blueprint == 'debug':
+        return
+    data = request.get_json(silent=True) or {}
+    g.profile_session_id = data.get('session_id') or request.args.get('session_id') or 'no-session'
+    g.profile_name = '_'.join([
+        secure_filename(g.profile_session_id),
+        time.strftime('%Y%m%d-%H%M%S') + f"{time.time() % 1:.3f}"[1:],
+        secure_filename(request.path.strip('/')) or 'index'
+    ])
+    g.profiler = SamplingProfiler(current_app.config.get('PROFILING_INTERVAL', 0.005))
+    g.profiler.start()
+
+@debug_bp.after_app_request
+def add_profile_header(response):
+    """在响应头中返回分析结果的名称"""
+    if 'profiler' in g:
+        response.headers['X-Profile-Id'] = g.profile_name
+    return response
+
+@debug_bp.teardown_app_request
+def save_profile(exc):
+    """请求结束（流式响应在最后一行输出后）时停止采样并保存结果"""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.stop()
+        path = profiler.save(current_app.config['PROFILE_FOLDER'], g.profile_name, {
+            'session_id': g.profile_session_id,
+            'method': request.method,
+            'path': request.path,
+            'error': str(exc) if exc else None,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        logger.info(f"Saved profile of {request.path} ({profiler.duration:.2f}s, {profiler.samples} samples) to {path}")
+    except Exception as e:
+        logger.error(f"Failed to save profile: {str(e)}")
+
+@debug_bp.route('/profiles', methods=['GET'])
+def list_profiles():
+    """列出保存的分析结果，可按 session_id 过滤"""
+    try:
+        folder = current_app.config['PROFILE_FOLDER']
+        session_id = request.args.get('session_id')
+        names = sorted(
+            (name[:-len('.json')] for name in os.listdir(folder) if name.endswith('.json')),
+            reverse=True
+        ) if os.path.isdir(folder) else []
+        if session_id:
+            names = [name for name in names if name.startswith(secure_filename(session_id) + '_')]
+        return jsonify({'profiles': names})
+    except Exception as e:
+        logger.error(f"Error listing profiles: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@debug_bp.route('/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    """
+    返回一个分析结果：默认返回汇总（JSON），format=folded 时返回折叠栈文本，
+    可保存后用 flamegraph.pl 或 speedscope 查看
+    """
+    extension = 'folded' if request.args.get('format') == 'folded' else 'json'
+    filename = f"{secure_filename(name)}.{extension}"
+    folder = os.path.abspath(current_app.config['PROFILE_FOLDER'])
+    if not os.path.exists(os.path.join(folder, filename)):
+        abort(404)
+    return send_from_directory(folder, filename, mimetype='text/plain' if extension == 'folded' else None)
+
+@debug_bp.route('/memory', methods=['GET'])
+def memory_diff():
+    """
+    内存增长排查：每次调用拍摄一次 tracemalloc 快照并与上一次对比（第一次调用只开始跟踪），
+    定期调用即可看到两次之间增长最多的分配位置，同时返回当前PDF会话的数量
+
+    参数：limit（默认20）、group_by（lineno / traceback）、stop=1 停止跟踪
+    """
+    global _memory_tracker
+    try:
+        from app.routes.pdf import pdf_sessions
+        if _memory_tracker is None:
+            _memory_tracker = MemoryTracker(current_app.config.get('PROFILING_TRACEMALLOC_FRAMES', 10))
+        if request.args.get('stop'):
+            _memory_tracker.stop()
+            return jsonify({'stopped': True})
+
+        group_by = request.args.get('group_by', 'lineno')
+        if group_by not in ('lineno', 'traceback'):
+            return jsonify({'error': 'group_by must be lineno or traceback'}), 400
+        result = _memory_tracker.snapshot_diff(int(request.args.get('limit', 20)), group_by)
+        now = time.time()
+        result['pdf_sessions'] = {
+            'count': len(pdf_sessions),
+            'idle_seconds': sorted(round(now - s['last_active']) for s in list(pdf_sessions.values())),
+            'output_content_items': sum(len(s.get('output_content', [])) for s in list(pdf_sessions.values()))
+        }
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error taking memory snapshot: {str(e)}")
+        return jsonify({'error': str(e)}), 500
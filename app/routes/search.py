@@ -0,0 +1,55 @@
+from flask import Blueprint, jsonify, request, current_app, send_from_directory, abort, url_for
+from app.services.search_index import SearchIndex
+import os
+import time
+import logging
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+search_bp = Blueprint('search', __name__)
+
+@search_bp.route('/search', methods=['GET'])
+def search():
+    """
+    在所有上传的PDF和生成的笔记中全文检索
+
+    只查询已建立的索引；距上次扫描超过 SEARCH_REFRESH_INTERVAL 时在后台增量扫描，
+    indexing 为真表示扫描进行中，新文件稍后才能检索到
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Missing query'}), 400
+        limit = min(int(request.args.get('limit', 20)), 100)
+        kind = request.args.get('kind')  # 可选：pdf / note
+
+        started = time.perf_counter()
+        index = SearchIndex.from_config(current_app.config)
+        index.refresh_in_background()
+        results = index.search(query, limit=limit, kind=kind)
+
+        # 生成跳转链接：PDF 使用 #page=N 定位到页，笔记直接打开 Markdown 文件
+        for result in results:
+            url = url_for('search.get_file', filename=result['path'])
+            result['url'] = f"{url}#page={result['page_number']}" if result['kind'] == 'pdf' else url
+
+        took_ms = round((time.perf_counter() - started) * 1000, 2)
+        logger.info(f"Search '{query}' returned {len(results)} results in {took_ms} ms")
+        return jsonify({
+            'query': query,
+            'results': results,
+            'took_ms': took_ms,
+            'indexing': index.indexing
+        })
+    except Exception as e:
+        logger.error(f"Search error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@search_bp.route('/files/<path:filename>', methods=['GET'])
+def get_file(filename):
+    """提供上传的PDF和生成的笔记文件，用于检索结果跳转"""
+    if not filename.lower().endswith(('.pdf', '.md')):
+        abort(404)
+    upload_folder = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    return send_from_directory(upload_folder, filename)
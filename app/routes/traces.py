@@ -0,0 +1,62 @@
+from flask import Blueprint, jsonify, request, render_template
+from app.services.tracing import get_tracer
+import logging
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 请求追踪查询接口；未启用追踪（TRACING_ENABLED）时返回空结果
+trace_bp = Blueprint('traces', __name__, url_prefix='/traces')
+
+def _query_traces():
+    """按请求参数（session_id、limit）查询trace，未启用追踪时返回None"""
+    tracer = get_tracer()
+    if tracer is None:
+        return None
+    return tracer.traces(
+        session_id=request.args.get('session_id'),
+        limit=int(request.args.get('limit', 50))
+    )
+
+def _span_depths(trace):
+    """计算每个span在trace中的层级（根span为0），用于瀑布图缩进"""
+    parents = {span['span_id']: span['parent_id'] for span in trace['spans']}
+    depths = {}
+    for span_id in parents:
+        depth, parent = 0, parents[span_id]
+        while parent in parents and depth < len(parents):
+            depth, parent = depth + 1, parents[parent]
+        depths[span_id] = depth
+    return depths
+
+@trace_bp.route('', methods=['GET'])
+def list_traces():
+    """
+    返回最近的trace（每页处理一个），包含每个span的名称、开始时间、耗时和属性
+
+    参数：session_id（可选，只返回该会话的trace）、limit（默认50）
+    """
+    try:
+        traces = _query_traces()
+        if traces is None:
+            return jsonify({'enabled': False, 'traces': [], 'message': 'Tracing is disabled, set TRACING_ENABLED=true'})
+        return jsonify({'enabled': True, 'traces': traces})
+    except Exception as e:
+        logger.error(f"Error reading traces: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@trace_bp.route('/view', methods=['GET'])
+def view_traces():
+    """以瀑布图显示最近的trace，参数同 /traces"""
+    try:
+        traces = _query_traces()
+        return render_template(
+            'traces.html',
+            enabled=traces is not None,
+            traces=traces or [],
+            depths={trace['trace_id']: _span_depths(trace) for trace in traces or []},
+            session_id=request.args.get('session_id', '')
+        )
+    except Exception as e:
+        logger.error(f"Error rendering traces: {str(e)}")
+        return jsonify({'error': str(e)}), 500
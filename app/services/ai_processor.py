@@ -1,10 +1,14 @@
-import requests
 import json
 from flask import current_app
 import logging
-from app.models.session import chat_history
 import time
 import traceback
+from app.services.scheduler import get_scheduler, INTERACTIVE, RequestCancelled
+from app.services.hedging import get_hedge_policy
+from app.services.circuit_breaker import get_circuit_breaker, CircuitOpenError, CLOSED
+from app.services.key_pool import get_key_pool, NoAvailableKeyError, mask_key
+from app.services.model_router import get_model_router, ModelRouter
+from app.services import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +27,7 @@ class AIProcessor:
     - app/routes/pdf.py: 处理PDF文本转换
     """
 
-    def __init__(self):
+    def __init__(self, priority=INTERACTIVE, session_key=None):
         """
         初始化AI处理器
         
@@ -31,7 +35,14 @@ class AIProcessor:
         - API端点
         - 认证信息
         - Token计数器
+        
+        Args:
+            priority: 调度优先级，interactive（聊天、单页处理）或 bulk（批量、范围处理、预取）
+            session_key: 调度时用于公平轮转和取消的会话标识
         """
+        self.priority = priority
+        self.session_key = session_key
+        self.scheduler = get_scheduler()
         # 使用 xiaoai.plus 的 API
         self.url = "https://api.xiaoai.plus/v1/chat/completions"
         self.api_key = current_app.config['API_KEY']
@@ -40,106 +51,306 @@ class AIProcessor:
             raise ValueError("API_KEY not found in environment variables")
         
         # 使用正确的请求头格式
-        self.headers = {
+        self.headers = self._headers_for(self.api_key)
+        
+        # 密钥池：每次请求选择负载最低的可用密钥（未配置 API_KEYS 时只有 API_KEY 一个）
+        self.key_pool = get_key_pool()
+        
+        # 模型路由：按任务和输入长度选择模型和 max_tokens
+        self.model_router = get_model_router()
+        
+        # 请求对冲：配置了备用端点和密钥时对冲请求发往备用端点；
+        # 否则发往同一端点，并从密钥池另取一个密钥（密钥池的密钥不会发往备用端点）
+        self.hedge_policy = get_hedge_policy()
+        hedge_key = current_app.config.get('AI_HEDGE_API_KEY')
+        self.hedge_url = (current_app.config.get('AI_HEDGE_URL') or self.url) if hedge_key else self.url
+        self.hedge_headers = self._headers_for(hedge_key) if hedge_key else None
+        
+        # 熔断器：上游故障时请求立即失败
+        self.circuit_breaker = get_circuit_breaker()
+
+    @staticmethod
+    def _headers_for(api_key):
+        """使用指定密钥的请求头"""
+        return {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"  # 使用 Bearer token
+            "Authorization": f"Bearer {api_key}"  # 使用 Bearer token
         }
 
-    def process_text(self, text, instruction, is_chat=False):
-        """处理文本请求"""
-        try:
-            if is_chat:
-                logger.info("-"*30 + " API请求开始 " + "-"*30)
-                logger.info(f"用户输入: {text[:100]}...")
-            else:
-                logger.info("-"*30 + " PDF处理开始 " + "-"*30)
-                logger.info(f"处理PDF文本 (长度: {len(text)} 字符)")
-                logger.info(f"使用处理提示: {instruction[:100]}...")
-
-            # 构建请求内容
-            messages = []
-            if instruction:
-                messages.append({
-                    "role": "system",
-                    "content": instruction
-                })
-            
+    # 单次请求超时（秒）和最大尝试次数
+    REQUEST_TIMEOUT = 30
+    MAX_RETRIES = 5
+
+    def _build_payload(self, text, instruction, is_chat=False, history=None, task=None):
+        """记录请求日志并构建请求体，模型和 max_tokens 由模型路由决定"""
+        if is_chat:
+            logger.info("-"*30 + " API请求开始 " + "-"*30)
+            logger.info(f"用户输入: {text[:100]}...")
+        else:
+            logger.info("-"*30 + " PDF处理开始 " + "-"*30)
+            logger.info(f"处理PDF文本 (长度: {len(text)} 字符)")
+            logger.info(f"使用处理提示: {instruction[:100]}...")
+
+        # 构建请求内容
+        messages = []
+        if instruction:
             messages.append({
-                "role": "user",
-                "content": text
+                "role": "system",
+                "content": instruction
             })
-            
-            payload = {
-                "model": "claude-3-opus-20240229",
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2000
-            }
+        
+        for message in history or []:
+            messages.append({
+                "role": message['role'],
+                "content": message['content']
+            })
+        
+        messages.append({
+            "role": "user",
+            "content": text
+        })
+        
+        route = self.model_router.route(
+            task or ('chat' if is_chat else 'page'),
+            ModelRouter.estimate_input_tokens(text, instruction, history),
+            instruction
+        )
+        logger.info(f"模型路由: {route['task']} -> {route['model']} (max_tokens: {route['max_tokens']})")
+        
+        payload = {
+            "model": route['model'],
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": route['max_tokens']
+        }
 
-            logger.debug(f"请求内容: {json.dumps(payload, ensure_ascii=False)}")
-            
+        logger.debug(f"请求内容: {json.dumps(payload, ensure_ascii=False)}")
+        return payload
+
+    def _format_result(self, result, instruction, payload=None):
+        """解析API响应，记录token使用情况并格式化输出结果"""
+        choice = result['choices'][0]
+        content = choice['message']['content']
+        logger.info(f"AI响应: {content[:100]}...")
+        if choice.get('finish_reason') == 'length':
+            logger.warning(f"AI响应达到 max_tokens ({(payload or {}).get('max_tokens')}) 被截断")
+        
+        # 记录token使用情况
+        usage = result.get('usage', {})
+        logger.info("Token使用情况:")
+        logger.info(f"  - 提示tokens: {usage.get('prompt_tokens', 0)}")
+        logger.info(f"  - 回复tokens: {usage.get('completion_tokens', 0)}")
+        logger.info(f"  - 总计tokens: {usage.get('total_tokens', 0)}")
+        
+        logger.info("-"*30 + " API请求结束 " + "-"*30)
+
+        return {
+            'success': True,
+            'content': content,
+            'usage': usage,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'prompt': instruction,
+            'model': result.get('model') or (payload or {}).get('model'),
+            'finish_reason': choice.get('finish_reason')  # length 表示输出被 max_tokens 截断
+        }
+
+    @staticmethod
+    def _format_cancelled():
+        """排队时被取消的结果，带 cancelled 标记以便批量处理停止"""
+        logger.info("请求在排队时被取消")
+        return {"error": "请求已取消", "cancelled": True}
+
+    @staticmethod
+    def _format_unavailable(e):
+        """
+        上游暂不可用时的结果（未发送请求即失败）
+        
+        unavailable 为 circuit_open（熔断中）或 no_api_key（所有密钥被隔离或限流），
+        retry_after 为建议的重试等待秒数
+        """
+        logger.warning(str(e))
+        reason = 'circuit_open' if isinstance(e, CircuitOpenError) else 'no_api_key'
+        return {"error": str(e), "unavailable": reason, "retry_after": e.retry_after}
+
+    def _release_key(self, key, status_code=None, headers=None, body='', result=None):
+        """把一次请求的结果记入密钥池（用量、限流和鉴权错误）"""
+        tokens = (result or {}).get('usage', {}).get('total_tokens', 0)
+        try:
+            retry_after = float((headers or {}).get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        self.key_pool.release(key, status_code, tokens, retry_after, body)
+
+    def _should_switch_key(self, key, status_code, retry_count, max_retries):
+        """密钥被限流或失效时是否换一个密钥重试"""
+        if not self.key_pool.is_key_error(status_code) or retry_count + 1 >= max_retries:
+            return False
+        logger.warning(f"API密钥 {mask_key(key)} 返回 {status_code}，换一个密钥重试")
+        return True
+
+    def _check_circuit(self):
+        """
+        发送前检查熔断器
+        
+        Returns:
+            tuple: (本次请求的最大尝试次数, 是否为探测请求)，探测请求只尝试一次
+        
+        Raises:
+            CircuitOpenError: 熔断中
+        """
+        if self.circuit_breaker is None:
+            return self.MAX_RETRIES, False
+        probe = self.circuit_breaker.allow()
+        return (1 if probe else self.MAX_RETRIES), probe
+
+    def _release_probe(self, probe):
+        """请求结束时归还探测名额（已记录结果时无影响），避免未发送的探测让熔断一直保持"""
+        if probe:
+            self.circuit_breaker.release_probe()
+
+    def _record_outcome(self, status_code=None, latency=0.0):
+        """
+        把一次请求结果记入熔断器：超时或连接错误（status_code 为 None）和 5xx 计为失败，
+        只有 2xx 计为成功；401/403/429 等 4xx 只说明密钥或请求本身有问题，由密钥池处理，
+        不说明上游是否健康，不记录（探测请求的名额在请求结束时由 _release_probe 归还）
+        
+        Raises:
+            CircuitOpenError: 本次失败导致熔断打开时，停止后续重试
+        """
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return
+        if status_code is None or status_code >= 500:
+            breaker.record_failure()
+            if breaker.state != CLOSED:
+                raise CircuitOpenError(max(int(breaker.open_seconds), 1))
+        elif 200 <= status_code < 300:
+            breaker.record_success(latency)
+
+    @staticmethod
+    def _format_error(e):
+        """记录异常并返回错误结果"""
+        logger.error("-"*30 + " 错误信息 " + "-"*30)
+        logger.error(f"处理请求时出错: {str(e)}")
+        logger.error(f"错误追踪: {traceback.format_exc()}")
+        logger.error("-"*30 + " 错误结束 " + "-"*30)
+        return {"error": str(e)}
+
+    def process_text(self, text, instruction, is_chat=False, history=None, task=None):
+        """
+        处理文本请求
+        
+        Args:
+            text: 用户输入或页面文本
+            instruction: 系统提示
+            is_chat: 是否为聊天请求（仅影响日志）
+            history: 可选的历史消息列表 [{'role': ..., 'content': ...}]，
+                按顺序插入在系统提示和本次输入之间
+            task: 任务类型，用于模型路由（chat / chat_summary / page / document），
+                默认按 is_chat 取 chat 或 page
+        """
+        if self.hedge_policy is not None:
+            # 启用对冲时交给共享事件循环执行，落后的请求可以被真正取消
+            from app.services.async_ai_processor import AsyncAIProcessor
+            processor = AsyncAIProcessor(priority=self.priority, session_key=self.session_key)
+            return processor.submit(text, instruction, is_chat, history, task).result()
+        
+        with tracing.span('ai.request', task=task, priority=self.priority) as request_span:
+            result = self._process_text(text, instruction, is_chat, history, task)
+            request_span.set(model=result.get('model'), outcome=self._outcome(result))
+            return result
+
+    def _process_text(self, text, instruction, is_chat, history, task):
+        """process_text 的同步实现：排队获取名额后发送请求，超时或连接失败时重试"""
+        import requests  # 首次发送请求时才加载，加快应用启动
+        
+        probe = False
+        try:
+            payload = self._build_payload(text, instruction, is_chat, history, task)
+            max_retries, probe = self._check_circuit()
+            with tracing.span('scheduler.wait'):
+                ticket = self.scheduler.acquire(self.priority, self.session_key)
+        except CircuitOpenError as e:
+            return self._format_unavailable(e)
+        except RequestCancelled:
+            self._release_probe(probe)
+            return self._format_cancelled()
+        except Exception as e:
+            self._release_probe(probe)
+            return self._format_error(e)
+        
+        try:
             # 发送请求
-            max_retries = 5
             retry_count = 0
             
             while retry_count < max_retries:
-                try:
-                    logger.info(f"发送API请求 (第 {retry_count + 1}/{max_retries} 次尝试)")
-                    response = requests.post(
-                        self.url,
-                        headers=self.headers,
-                        json=payload,
-                        timeout=30
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        content = result['choices'][0]['message']['content']
-                        logger.info(f"AI响应: {content[:100]}...")
-                        
-                        # 记录token使用情况
-                        usage = result.get('usage', {})
-                        logger.info("Token使用情况:")
-                        logger.info(f"  - 提示tokens: {usage.get('prompt_tokens', 0)}")
-                        logger.info(f"  - 回复tokens: {usage.get('completion_tokens', 0)}")
-                        logger.info(f"  - 总计tokens: {usage.get('total_tokens', 0)}")
+                key = self.key_pool.acquire()
+                with tracing.span('ai.attempt', attempt=retry_count + 1, model=payload['model'],
+                                  key=mask_key(key)) as attempt_span:
+                    try:
+                        logger.info(f"发送API请求 (第 {retry_count + 1}/{max_retries} 次尝试)")
+                        started = time.monotonic()
+                        response = requests.post(
+                            self.url,
+                            headers=self._headers_for(key),
+                            json=payload,
+                            timeout=self.REQUEST_TIMEOUT
+                        )
+                        attempt_span.set(status_code=response.status_code)
                         
-                        logger.info("-"*30 + " API请求结束 " + "-"*30)
-
-                        # 格式化输出结果
-                        formatted_result = {
-                            'success': True,
-                            'content': content,
-                            'usage': usage,
-                            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-                            'prompt': instruction
-                        }
+                        if response.status_code == 200:
+                            result = response.json()
+                            attempt_span.set(tokens=result.get('usage', {}))
+                            self._release_key(key, 200, result=result)
+                            self._record_outcome(200, time.monotonic() - started)
+                            return self._format_result(result, instruction, payload)
                         
-                        return formatted_result
-                        
-                    else:
+                        self._release_key(key, response.status_code, response.headers, response.text)
+                        self._record_outcome(response.status_code, time.monotonic() - started)
+                        if self._should_switch_key(key, response.status_code, retry_count, max_retries):
+                            retry_count += 1
+                            continue
                         raise Exception(f"API请求失败: {response.status_code} - {response.text}")
-                    
-                except (requests.Timeout, requests.ConnectionError) as e:
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        logger.warning(f"请求失败 (第 {retry_count}/{max_retries} 次尝试): {str(e)}")
+                        
+                    except (requests.Timeout, requests.ConnectionError) as e:
+                        attempt_span.set(network_error=f"{type(e).__name__}: {e}")
+                        self._release_key(key)
+                        self._record_outcome()
+                        retry_count += 1
+                        if retry_count < max_retries:
+                            logger.warning(f"请求失败 (第 {retry_count}/{max_retries} 次尝试): {str(e)}")
+                        else:
+                            raise TimeoutError("API请求超时,已达到最大重试次数")
+                if retry_count < max_retries:
+                    with tracing.span('ai.retry_wait'):
                         time.sleep(1)
-                    else:
-                        raise TimeoutError("API请求超时,已达到最大重试次数")
                     
+        except (CircuitOpenError, NoAvailableKeyError) as e:
+            return self._format_unavailable(e)
         except Exception as e:
-            logger.error("-"*30 + " 错误信息 " + "-"*30)
-            logger.error(f"处理请求时出错: {str(e)}")
-            logger.error(f"错误追踪: {traceback.format_exc()}")
-            logger.error("-"*30 + " 错误结束 " + "-"*30)
-            return {"error": str(e)}
+            return self._format_error(e)
+        finally:
+            self._release_probe(probe)
+            self.scheduler.release(ticket)
+
+    @staticmethod
+    def _outcome(result):
+        """请求结果的简短分类，记录在追踪中"""
+        if 'error' not in result:
+            return 'ok'
+        if result.get('cancelled'):
+            return 'cancelled'
+        if result.get('unavailable'):
+            return result['unavailable']
+        return 'error'
 
     def test_api(self):
         """测试API连接和响应"""
+        import requests
+        
         try:
             test_payload = {
-                "model": "claude-3-opus-20240229",
+                "model": self.model_router.models['fast'],
                 "messages": [
                     {
                         "role": "user",
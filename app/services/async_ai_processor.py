@@ -0,0 +1,241 @@
+import time
+import asyncio
+import logging
+import threading
+from flask import current_app
+from app.services.ai_processor import AIProcessor
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.key_pool import NoAvailableKeyError, mask_key
+from app.services import tracing
+
+logger = logging.getLogger(__name__)
+
+# 共享的后台事件循环，首次使用时创建
+_ai_loop = None
+_ai_loop_lock = threading.Lock()
+
+
+class _AILoop:
+    """
+    在后台线程中运行的共享事件循环
+    所有异步API请求都在这个循环上执行，共用一个HTTP连接池，
+    因此一个线程即可同时挂起大量等待上游响应的请求（并发名额由 RequestScheduler 统一分配）
+    """
+
+    def __init__(self, max_concurrency, timeout):
+        import httpx  # 仅异步路径需要
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='ai-event-loop', daemon=True)
+        self.thread.start()
+
+        async def setup():
+            self.client = httpx.AsyncClient(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_concurrency)
+            )
+        asyncio.run_coroutine_threadsafe(setup(), self.loop).result()
+        logger.info(f"AI event loop started (max concurrency: {max_concurrency})")
+
+    def submit(self, coro):
+        """把协程提交到共享循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+def get_ai_loop():
+    """获取共享的后台事件循环"""
+    global _ai_loop
+    with _ai_loop_lock:
+        if _ai_loop is None:
+            _ai_loop = _AILoop(
+                current_app.config.get('AI_MAX_CONCURRENCY', 20),
+                AIProcessor.REQUEST_TIMEOUT
+            )
+        return _ai_loop
+
+
+class AsyncAIProcessor(AIProcessor):
+    """
+    异步AI处理服务类
+    用途：AIProcessor 的异步版本，供异步视图使用；请求在共享事件循环上用非阻塞
+    HTTP客户端发送，与同步请求共用 RequestScheduler 的并发名额（AI_MAX_CONCURRENCY）
+
+    请求体构建、响应解析和重试策略与 AIProcessor 保持一致
+
+    被调用位置：
+    - app/routes/chat.py: /chat
+    - app/routes/pdf.py: /process-page
+    """
+
+    async def process_text_async(self, text, instruction, is_chat=False, history=None, task=None):
+        """
+        异步处理文本请求，参数和返回值与 process_text 相同
+
+        可以在任意事件循环中 await：实际请求在共享事件循环上执行
+        """
+        try:
+            future = self.submit(text, instruction, is_chat, history, task)
+        except Exception as e:
+            return self._format_error(e)
+        return await asyncio.wrap_future(future)
+
+    def submit(self, text, instruction, is_chat=False, history=None, task=None):
+        """
+        把请求提交到共享事件循环后立即返回，不等待结果
+
+        Returns:
+            concurrent.futures.Future: 结果与 process_text 相同；取消它会中止上游HTTP请求
+        """
+        payload = self._build_payload(text, instruction, is_chat, history, task)
+        ai_loop = get_ai_loop()
+        return ai_loop.submit(self._request(ai_loop, payload, instruction))
+
+    async def _request(self, ai_loop, payload, instruction):
+        """在共享事件循环上排队获取名额后发送请求，超时或连接失败时重试"""
+        with tracing.span('ai.request', model=payload['model'], max_tokens=payload['max_tokens'],
+                          priority=self.priority) as request_span:
+            result = await self._send(ai_loop, payload, instruction)
+            request_span.set(outcome=self._outcome(result))
+            return result
+
+    async def _send(self, ai_loop, payload, instruction):
+        """_request 的实现"""
+        import httpx
+
+        try:
+            max_retries, probe = self._check_circuit()
+        except CircuitOpenError as e:
+            return self._format_unavailable(e)
+
+        ticket = self.scheduler.submit(self.priority, self.session_key)
+        try:
+            try:
+                with tracing.span('scheduler.wait'):
+                    await asyncio.wrap_future(ticket.future)
+            except asyncio.CancelledError:
+                if ticket.state == 'cancelled':
+                    return self._format_cancelled()
+                raise
+
+            retry_count = 0
+
+            while retry_count < max_retries:
+                key = self.key_pool.acquire()
+                with tracing.span('ai.attempt', attempt=retry_count + 1, model=payload['model'],
+                                  key=mask_key(key)) as attempt_span:
+                    try:
+                        logger.info(f"发送异步API请求 (第 {retry_count + 1}/{max_retries} 次尝试)")
+                        started = time.monotonic()
+                        response, hedge_won = await self._post(ai_loop, payload, self._headers_for(key))
+
+                    except (httpx.TimeoutException, httpx.TransportError) as e:
+                        attempt_span.set(network_error=f"{type(e).__name__}: {e}")
+                        self._release_key(key)
+                        self._record_outcome()
+                        retry_count += 1
+                        if retry_count < max_retries:
+                            logger.warning(f"请求失败 (第 {retry_count}/{max_retries} 次尝试): {str(e)}")
+                        else:
+                            raise TimeoutError("API请求超时,已达到最大重试次数")
+                    except BaseException:
+                        # 请求被取消（例如预取作废）时也要归还密钥
+                        self._release_key(key)
+                        raise
+                    else:
+                        attempt_span.set(status_code=response.status_code, hedge_won=hedge_won)
+                        if response.status_code == 200:
+                            result = response.json()
+                            attempt_span.set(tokens=result.get('usage', {}))
+                            if hedge_won:
+                                # 结果已记入对冲请求的密钥，原请求被取消，只归还密钥
+                                self._release_key(key)
+                            else:
+                                self._release_key(key, 200, result=result)
+                            self._record_outcome(200, time.monotonic() - started)
+                            return self._format_result(result, instruction, payload)
+
+                        self._release_key(key, response.status_code, response.headers, response.text)
+                        self._record_outcome(response.status_code, time.monotonic() - started)
+                        if self._should_switch_key(key, response.status_code, retry_count, max_retries):
+                            retry_count += 1
+                            continue
+                        raise Exception(f"API请求失败: {response.status_code} - {response.text}")
+                with tracing.span('ai.retry_wait'):
+                    await asyncio.sleep(1)
+        except (CircuitOpenError, NoAvailableKeyError) as e:
+            return self._format_unavailable(e)
+        except Exception as e:
+            return self._format_error(e)
+        finally:
+            # 排队时被取消、预取作废或没有可用密钥时探测请求没有结果，归还探测名额
+            self._release_probe(probe)
+            self.scheduler.release(ticket)
+
+    async def _post(self, ai_loop, payload, headers):
+        """
+        发送一次请求；启用对冲时，请求耗时超过对冲阈值且预算允许则再发一个相同请求
+        （发往备用端点和密钥；未配置时发往同一端点，使用从密钥池另取的密钥），
+        先成功返回的结果胜出，另一个请求被取消
+
+        Returns:
+            tuple: (响应, 是否为对冲请求的响应)；只有对冲请求成功胜出时第二项为真，
+            都失败时返回原请求的结果或抛出原请求的异常
+        """
+        policy = self.hedge_policy
+        if policy is None:
+            return await ai_loop.client.post(self.url, headers=headers, json=payload), False
+
+        policy.on_request()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(ai_loop.client.post(self.url, headers=headers, json=payload))
+        delay = policy.delay()
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        hedge_key = None
+        if not done and self.hedge_headers is None:
+            # 对冲请求的密钥同样经过密钥池，用量、限流和冷却照常计入
+            try:
+                hedge_key = self.key_pool.acquire()
+            except NoAvailableKeyError:
+                done = True
+        if done or not policy.try_hedge():
+            if hedge_key is not None:
+                self.key_pool.release(hedge_key)
+            response = await primary
+            if response.status_code == 200:
+                policy.record(time.monotonic() - started)
+            return response, False
+
+        logger.info(f"请求超过 {delay:.1f} 秒未返回，发送对冲请求")
+        hedge_started = time.monotonic()
+        hedge = asyncio.ensure_future(ai_loop.client.post(
+            self.hedge_url, json=payload,
+            headers=self.hedge_headers or self._headers_for(hedge_key)
+        ))
+        pending = {primary, hedge}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        hedge_won = task is hedge
+                        policy.record(time.monotonic() - (hedge_started if hedge_won else started), hedge_won)
+                        logger.info(f"{'对冲请求' if hedge_won else '原请求'}先返回")
+                        return task.result(), hedge_won
+                if not pending:
+                    # 两个请求都失败，按原请求的结果（或异常）交给重试逻辑处理，
+                    # 对冲请求的结果只记入它自己的密钥
+                    return primary.result(), False
+        finally:
+            for task in pending:
+                task.cancel()
+            if hedge_key is not None:
+                self._release_hedge_key(hedge_key, hedge)
+
+    def _release_hedge_key(self, key, hedge):
+        """把对冲请求的结果记入密钥池；被取消或网络错误时只归还密钥"""
+        if not hedge.done() or hedge.cancelled() or hedge.exception() is not None:
+            self.key_pool.release(key)
+            return
+        response = hedge.result()
+        result = response.json() if response.status_code == 200 else None
+        self._release_key(key, response.status_code, response.headers, response.text, result=result)
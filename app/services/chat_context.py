@@ -0,0 +1,153 @@
+import logging
+from app.config.prompts import CHAT_SUMMARY_PROMPT
+from app.utils.text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ChatContextBuilder:
+    """
+    聊天上下文构建服务类
+    用途：在token预算内为模型构建对话上下文，最近的对话原样发送，
+    更早的对话压缩为滚动摘要，避免发送全部历史导致延迟过高
+
+    摘要状态：
+    - summary_state = {'upto_seq': 已被摘要覆盖的最后一条消息序号, 'text': 摘要文本}
+    - 只有超出预算、尚未被摘要覆盖的消息累计超过 summary_batch_tokens 时才调用一次AI更新摘要，
+      在此之前这些消息仍原样保留，因此不会丢失上下文
+
+    被调用位置：
+    - app/routes/chat.py: 处理聊天请求时
+    """
+
+    def __init__(self, token_budget=2000, summary_batch_tokens=600):
+        """
+        初始化上下文构建器
+
+        Args:
+            token_budget: 原样发送的历史消息的估算token上限
+            summary_batch_tokens: 待摘要的消息累计达到该token数时才更新摘要
+        """
+        self.token_budget = token_budget
+        self.summary_batch_tokens = summary_batch_tokens
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建上下文构建器"""
+        return cls(
+            token_budget=config.get('CHAT_CONTEXT_TOKEN_BUDGET', 2000),
+            summary_batch_tokens=config.get('CHAT_SUMMARY_BATCH_TOKENS', 600),
+        )
+
+    @staticmethod
+    def _message_tokens(message):
+        """估算单条消息的token数（含少量角色标记开销）"""
+        return estimate_tokens(message['content']) + 4
+
+    @staticmethod
+    def _summary_input(previous_summary, messages):
+        """把已有摘要和新增对话拼接为摘要请求的输入"""
+        transcript = "\n\n".join(
+            f"{'用户' if m['role'] == 'user' else 'AI助手'}: {m['content']}" for m in messages
+        )
+        return f"已有摘要：\n{previous_summary or '（无）'}\n\n新增对话：\n{transcript}"
+
+    @staticmethod
+    def _summary_result(response):
+        """从摘要请求的结果中取出摘要，失败时返回None"""
+        if 'error' in response:
+            logger.error(f"更新对话摘要失败: {response['error']}")
+            return None
+        return response['content']
+
+    def _summarize(self, ai_processor, previous_summary, messages):
+        """调用AI把已有摘要和新增对话合并为新的摘要，失败时返回None"""
+        response = ai_processor.process_text(
+            self._summary_input(previous_summary, messages), CHAT_SUMMARY_PROMPT, is_chat=True, task='chat_summary'
+        )
+        return self._summary_result(response)
+
+    async def _summarize_async(self, ai_processor, previous_summary, messages):
+        """_summarize 的异步版本，使用 AsyncAIProcessor 等待摘要结果，不阻塞事件循环"""
+        response = await ai_processor.process_text_async(
+            self._summary_input(previous_summary, messages), CHAT_SUMMARY_PROMPT, is_chat=True, task='chat_summary'
+        )
+        return self._summary_result(response)
+
+    def _split(self, history, summary_state):
+        """
+        把尚未被摘要覆盖的历史分为预算内原样发送的最近消息和超出预算的消息
+
+        Returns:
+            tuple: (最近消息, 最近消息的token数, 超出预算的消息, 超出部分的token数)
+        """
+        history = [m for m in history if m['seq'] > summary_state.get('upto_seq', 0)]
+
+        # 从最新的消息往前取，直到达到预算
+        recent, used = [], 0
+        for message in reversed(history):
+            tokens = self._message_tokens(message)
+            if used + tokens > self.token_budget:
+                break
+            recent.append(message)
+            used += tokens
+        recent.reverse()
+
+        overflow = history[:len(history) - len(recent)]
+        return recent, used, overflow, sum(self._message_tokens(m) for m in overflow)
+
+    def _needs_summary(self, overflow, overflow_tokens):
+        return bool(overflow) and overflow_tokens >= self.summary_batch_tokens
+
+    def _assemble(self, recent, used, overflow, overflow_tokens, summary_state, summary):
+        """根据摘要结果（未更新时为None）更新摘要状态并组装返回值"""
+        summarized = summary is not None
+        if summarized:
+            summary_state['text'] = summary
+            summary_state['upto_seq'] = overflow[-1]['seq']
+            logger.info(f"对话摘要已更新，覆盖到第 {overflow[-1]['seq']} 条消息")
+        else:
+            # 待摘要的消息还不够一批（或摘要失败），暂时原样保留
+            recent = overflow + recent
+            used += overflow_tokens
+
+        summary_text = summary_state.get('text', '')
+        stats = {
+            'history_tokens': used,
+            'summary_tokens': estimate_tokens(summary_text),
+            'recent_messages': len(recent),
+            'summarized_upto': summary_state.get('upto_seq', 0),
+            'summary_updated': summarized
+        }
+        return [{'role': m['role'], 'content': m['content']} for m in recent], summary_text, stats
+
+    def build(self, history, summary_state, ai_processor):
+        """
+        构建本轮发送给模型的历史上下文
+
+        Args:
+            history: 按时间顺序排列的历史消息，每条包含 seq、role、content
+            summary_state: 摘要状态字典，摘要更新时会被原地修改
+            ai_processor: 用于更新摘要的 AIProcessor 实例
+
+        Returns:
+            tuple: (原样发送的历史消息列表, 摘要文本, 统计信息)
+        """
+        recent, used, overflow, overflow_tokens = self._split(history, summary_state)
+        summary = None
+        if self._needs_summary(overflow, overflow_tokens):
+            summary = self._summarize(ai_processor, summary_state.get('text', ''), overflow)
+        return self._assemble(recent, used, overflow, overflow_tokens, summary_state, summary)
+
+    async def build_async(self, history, summary_state, ai_processor):
+        """
+        build 的异步版本，供异步视图使用：更新摘要时 await AsyncAIProcessor，不阻塞视图的事件循环
+
+        Args:
+            ai_processor: 用于更新摘要的 AsyncAIProcessor 实例
+        """
+        recent, used, overflow, overflow_tokens = self._split(history, summary_state)
+        summary = None
+        if self._needs_summary(overflow, overflow_tokens):
+            summary = await self._summarize_async(ai_processor, summary_state.get('text', ''), overflow)
+        return self._assemble(recent, used, overflow, overflow_tokens, summary_state, summary)
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 断点文件名，位于 outputs/<会话ID>/ 下
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# 页面完成方式
+SAVED = 'saved'      # 已处理并保存 page_N.md
+SKIPPED = 'skipped'  # 预筛选跳过，无需处理
+MERGED = 'merged'    # 已合并到之后某页一起处理
+
+# 任务状态
+RUNNING = 'running'    # 处理中（服务重启后仍为该状态即表示被中断）
+STOPPED = 'stopped'    # 因取消或熔断提前停止
+FAILED = 'failed'      # 已处理到结束页，但有页面失败（见 failed），需通过 /resume-processing 重试
+COMPLETE = 'complete'  # 范围内所有页面已完成
+
+
+class RangeCheckpoint:
+    """
+    范围处理断点
+    用途：记录一次范围处理任务（文档哈希、提示、页码范围和已完成的页面），
+    服务重启或处理中断后可以从第一个未完成的页面继续，已完成的页面不再调用API
+
+    断点保存在 outputs/<会话ID>/checkpoint.json，和页面结果一样交给后台写入器按提交顺序写入，
+    因此断点中标记为已保存的页面，其 page_N.md 一定已先写入
+
+    被调用位置：
+    - app/routes/pdf.py: /process-range 创建断点，/resume-processing 和启动时恢复
+    """
+
+    def __init__(self, session_id, file_path, file_hash, prompt, start_page, end_page,
+                 completed=None, failed=None, status=RUNNING, created_at=None, updated_at=None):
+        """
+        初始化断点
+
+        Args:
+            session_id: 会话ID（同时也是输出目录名）
+            file_path: PDF文件路径
+            file_hash: PDF文件内容的SHA1，恢复时用于确认文件未被替换
+            prompt: 处理提示
+            start_page: 起始页码（从1开始）
+            end_page: 结束页码（含）
+            completed: 已完成的页面 {页码: saved / skipped / merged}
+            failed: 处理失败的页面 {页码: 错误信息}，恢复时会重新处理
+            status: 任务状态
+        """
+        self.session_id = session_id
+        self.file_path = file_path
+        self.file_hash = file_hash
+        self.prompt = prompt
+        self.start_page = start_page
+        self.end_page = end_page
+        self.completed = {int(page): how for page, how in (completed or {}).items()}
+        self.failed = {int(page): error for page, error in (failed or {}).items()}
+        self.status = status
+        self.created_at = created_at or time.strftime('%Y-%m-%d %H:%M:%S')
+        self.updated_at = updated_at or self.created_at
+
+    @staticmethod
+    def path(output_root, session_id):
+        """断点文件路径；output_root 为 uploads/outputs 目录"""
+        return os.path.join(output_root, session_id, CHECKPOINT_FILE)
+
+    @classmethod
+    def load(cls, output_root, session_id):
+        """
+        读取会话的断点，并去掉结果文件已不存在的页面
+
+        Returns:
+            RangeCheckpoint: 断点，不存在或无法解析时返回None
+        """
+        path = cls.path(output_root, session_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                checkpoint = cls(**json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Failed to load checkpoint {path}: {str(e)}")
+            return None
+        output_dir = os.path.dirname(path)
+        for page, how in list(checkpoint.completed.items()):
+            if how == SAVED and not os.path.exists(os.path.join(output_dir, f"page_{page}.md")):
+                logger.warning(f"Checkpoint {session_id}: page {page} output missing, will reprocess")
+                del checkpoint.completed[page]
+        return checkpoint
+
+    @classmethod
+    def find_incomplete(cls, output_root):
+        """返回 output_root 下所有未完成（被中断、提前停止或有失败页面）的断点"""
+        if not os.path.isdir(output_root):
+            return []
+        result = []
+        for session_id in sorted(os.listdir(output_root)):
+            checkpoint = cls.load(output_root, session_id)
+            if checkpoint is not None and checkpoint.status != COMPLETE:
+                result.append(checkpoint)
+        return result
+
+    def mark(self, page_number, how):
+        """标记页面已完成（saved / skipped / merged）"""
+        self.completed[page_number] = how
+        self.failed.pop(page_number, None)
+
+    def mark_failed(self, page_number, error):
+        """记录页面处理失败"""
+        self.failed[page_number] = error
+
+    def next_page(self):
+        """返回范围内第一个未完成的页码，全部完成时返回None"""
+        for page_number in range(self.start_page, self.end_page + 1):
+            if page_number not in self.completed:
+                return page_number
+        return None
+
+    def finish(self, stopped=False):
+        """
+        处理循环结束时设置最终状态（不再是 running，启动时不会自动重新处理）
+
+        Args:
+            stopped: 是否因取消或熔断提前停止
+        """
+        if self.next_page() is None:
+            self.status = COMPLETE
+        elif stopped:
+            self.status = STOPPED
+        else:
+            self.status = FAILED
+
+    def to_json(self):
+        """序列化为断点文件内容"""
+        self.updated_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        return json.dumps({
+            'session_id': self.session_id,
+            'file_path': self.file_path,
+            'file_hash': self.file_hash,
+            'prompt': self.prompt,
+            'start_page': self.start_page,
+            'end_page': self.end_page,
+            'completed': {str(page): how for page, how in sorted(self.completed.items())},
+            'failed': {str(page): error for page, error in sorted(self.failed.items())},
+            'status': self.status,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }, ensure_ascii=False, indent=2)
+
+    def summary(self):
+        """返回给前端的断点概要"""
+        return {
+            'session_id': self.session_id,
+            'file': os.path.basename(self.file_path),
+            'start_page': self.start_page,
+            'end_page': self.end_page,
+            'completed_pages': len(self.completed),
+            'failed_pages': sorted(self.failed),
+            'next_page': self.next_page(),
+            'status': self.status,
+            'updated_at': self.updated_at
+        }
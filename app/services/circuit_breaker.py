@@ -0,0 +1,193 @@
+import time
+import logging
+import threading
+from collections import deque
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CLOSED = 'closed'        # 正常放行
+OPEN = 'open'            # 熔断中，请求直接失败
+HALF_OPEN = 'half_open'  # 冷却结束，只放行一个探测请求
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求未发送即失败"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"上游服务暂不可用，已熔断，约 {retry_after} 秒后重试")
+
+
+class CircuitBreaker:
+    """
+    上游接口熔断器
+    用途：上游故障时让请求立即失败，而不是每页都耗尽 5 次 × 30 秒的重试
+
+    状态转换：
+    - closed: 最近 window 次请求中失败（超时、连接错误、5xx）和慢请求
+      （超过 slow_call_seconds）的比例达到 failure_ratio，且样本不少于 min_requests 时打开
+    - open: 所有请求立即失败；open_seconds 后进入 half_open
+    - half_open: 只放行一个探测请求，成功则关闭并清空统计，失败则重新打开
+
+    被调用位置：
+    - app/services/ai_processor.py: 同步请求
+    - app/services/async_ai_processor.py: 异步请求
+    - app/routes/pdf.py: /scheduler-stats 返回熔断状态
+    """
+
+    def __init__(self, failure_ratio=0.5, window=20, min_requests=5,
+                 slow_call_seconds=25.0, open_seconds=30.0, probe_timeout=60.0):
+        """
+        初始化熔断器
+
+        Args:
+            failure_ratio: 触发熔断的失败（含慢请求）比例
+            window: 统计的最近请求数
+            min_requests: 开始判断前需要的最少请求数
+            slow_call_seconds: 超过该耗时的成功请求也计为失败
+            open_seconds: 熔断后等待多久开始探测
+            probe_timeout: 探测请求超过该时间仍未结束时允许发出新的探测
+        """
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self._outcomes = deque(maxlen=window)  # True 表示失败或慢请求
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._rejected = 0
+        self._times_opened = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建熔断器，未启用时返回None"""
+        if not config.get('AI_CIRCUIT_ENABLED', True):
+            return None
+        return cls(
+            failure_ratio=config.get('AI_CIRCUIT_FAILURE_RATIO', 0.5),
+            window=config.get('AI_CIRCUIT_WINDOW', 20),
+            min_requests=config.get('AI_CIRCUIT_MIN_REQUESTS', 5),
+            slow_call_seconds=config.get('AI_CIRCUIT_SLOW_SECONDS', 25.0),
+            open_seconds=config.get('AI_CIRCUIT_OPEN_SECONDS', 30.0),
+            probe_timeout=config.get('AI_CIRCUIT_PROBE_TIMEOUT', 60.0),
+        )
+
+    @property
+    def state(self):
+        """当前状态（open 冷却结束后显示为 half_open）"""
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        """open 状态冷却结束后转为 half_open（调用方持有锁）"""
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_started = None
+            logger.info("Circuit half-open, waiting for a probe request")
+
+    def allow(self):
+        """
+        检查是否放行请求
+
+        Returns:
+            bool: 放行的是否为探测请求（探测请求不应重试）
+
+        Raises:
+            CircuitOpenError: 熔断中，或已有探测请求在进行
+        """
+        with self._lock:
+            self._update_state()
+            if self._state == CLOSED:
+                return False
+            now = time.monotonic()
+            if self._state == HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started > self.probe_timeout
+            ):
+                self._probe_started = now
+                return True
+            self._rejected += 1
+            retry_after = max(self.open_seconds - (now - self._opened_at), 1)
+            raise CircuitOpenError(int(retry_after))
+
+    def release_probe(self):
+        """
+        归还探测名额：探测请求未发送就结束（排队时被取消、没有可用密钥等）时调用，
+        下一个请求可以立即成为探测请求；已记录结果时状态不再是 half_open，调用无影响
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._probe_started is not None:
+                self._probe_started = None
+                logger.info("Circuit probe released without an outcome")
+
+    def record_success(self, latency):
+        """记录一次成功的请求及其耗时（秒）"""
+        slow = latency > self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if slow:
+                    self._open('slow probe')
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logger.info("Circuit closed, upstream recovered")
+                return
+            self._outcomes.append(slow)
+            self._check()
+
+    def record_failure(self):
+        """记录一次失败的请求"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open('probe failed')
+                return
+            self._outcomes.append(True)
+            self._check()
+
+    def _check(self):
+        """失败比例达到阈值时打开熔断（调用方持有锁）"""
+        if self._state != CLOSED or len(self._outcomes) < self.min_requests:
+            return
+        failures = sum(self._outcomes)
+        if failures / len(self._outcomes) >= self.failure_ratio:
+            self._open(f"{failures}/{len(self._outcomes)} recent requests failed or were slow")
+
+    def _open(self, reason):
+        """打开熔断（调用方持有锁）"""
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started = None
+        self._times_opened += 1
+        logger.warning(f"Circuit opened: {reason}")
+
+    def stats(self):
+        """返回熔断状态和统计"""
+        with self._lock:
+            self._update_state()
+            return {
+                'state': self._state,
+                'recent_requests': len(self._outcomes),
+                'recent_failures': sum(self._outcomes),
+                'rejected': self._rejected,
+                'times_opened': self._times_opened
+            }
+
+
+# 共享的熔断器（所有请求共同反映上游健康状况），首次使用时根据配置创建
+_circuit_breaker = None
+_circuit_breaker_loaded = False
+_circuit_breaker_lock = threading.Lock()
+
+def get_circuit_breaker():
+    """获取共享的熔断器，未启用时返回None"""
+    global _circuit_breaker, _circuit_breaker_loaded
+    with _circuit_breaker_lock:
+        if not _circuit_breaker_loaded:
+            _circuit_breaker = CircuitBreaker.from_config(current_app.config)
+            _circuit_breaker_loaded = True
+        return _circuit_breaker
@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# MinHash 使用的大素数（2^61 - 1）
+MERSENNE_PRIME = (1 << 61) - 1
+
+# 共享索引实例，按索引文件路径区分
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def prompt_key(prompt):
+    """生成提示文本的稳定哈希，只有使用相同提示的结果才能互相复用"""
+    return hashlib.sha1((prompt or '').strip().encode('utf-8')).hexdigest()
+
+
+class DedupIndex:
+    """
+    跨文档相似页面索引
+    用途：对已处理页面的文本建立 MinHash 签名和 LSH 分桶，新页面与使用相同提示
+    处理过的页面足够相似时，直接复用或提示已有结果，避免重复调用API
+
+    实现：
+    - 文本先去掉空白和标点并转小写，再切分为字符 n-gram（对中英文都适用）
+    - 每个 n-gram 经 num_perm 个哈希函数取最小值得到签名
+    - 签名分为 bands 段，任意一段完全相同即成为候选，再用签名估算 Jaccard 相似度
+    - 索引以 JSONL 追加写入磁盘，重启后自动加载
+
+    被调用位置：
+    - app/routes/pdf.py: 页面处理前查询，处理成功后写入
+    """
+
+    def __init__(self, index_path, num_perm=64, bands=16, shingle_size=5, threshold=0.9):
+        """
+        初始化相似页面索引
+
+        Args:
+            index_path: 索引文件路径（JSONL）
+            num_perm: MinHash 哈希函数个数
+            bands: LSH 分段数，num_perm 必须能被其整除
+            shingle_size: 字符 n-gram 长度
+            threshold: 判定为重复的最低估算相似度
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.index_path = index_path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+
+        # 由固定种子生成哈希参数，保证签名在重启后仍然一致
+        seeds = hashlib.sha512(b'dedup-index-minhash').digest()
+        self._params = []
+        for i in range(num_perm):
+            digest = hashlib.blake2b(seeds + i.to_bytes(4, 'big'), digest_size=16).digest()
+            a = int.from_bytes(digest[:8], 'big') % (MERSENNE_PRIME - 1) + 1
+            b = int.from_bytes(digest[8:], 'big') % MERSENNE_PRIME
+            self._params.append((a, b))
+
+        self._lock = threading.Lock()
+        self._entries = []
+        self._buckets = defaultdict(list)
+        self._load()
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置获取共享的索引实例，未启用时返回None"""
+        if not config.get('DEDUP_ENABLED', True):
+            return None
+        index_path = os.path.join(config.get('INDEX_FOLDER', 'uploads/index'), 'dedup_index.jsonl')
+        with _indexes_lock:
+            if index_path not in _indexes:
+                _indexes[index_path] = cls(index_path, threshold=config.get('DEDUP_THRESHOLD', 0.9))
+            return _indexes[index_path]
+
+    def _shingles(self, text):
+        """把文本规整后切分为字符 n-gram 集合"""
+        compact = re.sub(r'[\W_]+', '', (text or '').lower())
+        if len(compact) <= self.shingle_size:
+            return {compact} if compact else set()
+        return {compact[i:i + self.shingle_size] for i in range(len(compact) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        """
+        计算文本的 MinHash 签名
+
+        Returns:
+            list: 长度为 num_perm 的整数列表，文本为空时返回None
+        """
+        shingles = self._shingles(text)
+        if not shingles:
+            return None
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+            for s in shingles
+        ]
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self._params]
+
+    def _band_keys(self, signature, key):
+        """生成签名各段的分桶键，分桶键包含提示哈希"""
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            yield f"{key}:{band}:{hash(tuple(chunk))}"
+
+    def _insert(self, entry):
+        """把条目加入内存索引"""
+        position = len(self._entries)
+        self._entries.append(entry)
+        for bucket in self._band_keys(entry['signature'], entry['prompt_key']):
+            self._buckets[bucket].append(position)
+
+    def _load(self):
+        """从磁盘加载已有索引"""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping corrupt line in dedup index")
+                    continue
+                if len(entry.get('signature', [])) == self.num_perm:
+                    self._insert(entry)
+        logger.info(f"Loaded {len(self._entries)} entries from dedup index {self.index_path}")
+
+    def query(self, text, prompt):
+        """
+        查找与文本最相似、且使用相同提示处理过的页面
+
+        Args:
+            text: 待处理的页面文本
+            prompt: 处理提示
+
+        Returns:
+            dict: 最相似条目（附带 similarity 字段），相似度相同时取最新加入的条目
+            （重新处理的结果优先于旧结果），相似度未达阈值时返回None
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        key = prompt_key(prompt)
+
+        with self._lock:
+            candidates = set()
+            for bucket in self._band_keys(signature, key):
+                candidates.update(self._buckets.get(bucket, ()))
+            best, best_score = None, 0.0
+            for position in sorted(candidates):
+                entry = self._entries[position]
+                score = sum(x == y for x, y in zip(signature, entry['signature'])) / self.num_perm
+                if score and score >= best_score:
+                    best, best_score = entry, score
+
+        if best is None or best_score < self.threshold:
+            return None
+        match = {k: v for k, v in best.items() if k != 'signature'}
+        match['similarity'] = round(best_score, 3)
+        return match
+
+    def add(self, text, prompt, content, source_file=None, page_number=None, usage=None):
+        """
+        把已处理页面加入索引并追加写入磁盘
+
+        Args:
+            text: 发送给AI的页面文本
+            prompt: 处理提示
+            content: AI处理结果
+            source_file: 来源PDF文件名
+            page_number: 来源页码
+            usage: 该结果消耗的token信息
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return
+        entry = {
+            'prompt_key': prompt_key(prompt),
+            'signature': signature,
+            'content': content,
+            'source_file': source_file,
+            'page_number': page_number,
+            'usage': usage or {},
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        with self._lock:
+            self._insert(entry)
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
@@ -0,0 +1,218 @@
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.config.prompts import DOC_REDUCE_PROMPT
+from app.services.ai_processor import AIProcessor
+from app.services.scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentError(Exception):
+    """整篇文档处理中某个节点失败"""
+
+    def __init__(self, message, response):
+        self.response = response
+        super().__init__(message)
+
+
+def _cache_key(*parts):
+    """按内容计算缓存键"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class DocumentSummarizer:
+    """
+    整篇文档处理服务类
+    用途：把选定的处理提示分块并行应用到整份PDF（map），再把各块结果逐层合并为
+    一份结果（reduce），用于整篇总结、整篇复习题等
+
+    - 每 pages_per_chunk 页为一块，分块边界只取决于页码，修改某一页只影响它所在的块
+    - 每 fan_in 个结果合并为上一层的一个节点，直到只剩一个
+    - 每个节点的结果按 (提示, 输入内容) 的哈希缓存在磁盘上，内容未变的节点直接复用，
+      因此某页内容变化时只会重新处理该页所在的块以及它到根节点路径上的合并
+
+    被调用位置：
+    - app/routes/pdf.py: /process-document
+    """
+
+    def __init__(self, cache_folder, pages_per_chunk=5, fan_in=4, max_workers=4):
+        """
+        初始化文档处理器
+
+        Args:
+            cache_folder: 中间结果缓存目录
+            pages_per_chunk: 每块的页数
+            fan_in: 每次合并的结果数
+            max_workers: 并行处理的块数
+        """
+        self.cache_folder = cache_folder
+        self.pages_per_chunk = pages_per_chunk
+        self.fan_in = max(fan_in, 2)
+        self.max_workers = max_workers
+        os.makedirs(cache_folder, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建文档处理器"""
+        return cls(
+            config.get('DOC_CACHE_FOLDER', os.path.join('uploads', 'doc_cache')),
+            pages_per_chunk=config.get('DOC_PAGES_PER_CHUNK', 5),
+            fan_in=config.get('DOC_REDUCE_FAN_IN', 4),
+            max_workers=config.get('DOC_MAX_WORKERS', 4),
+        )
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_folder, f"{key}.json")
+
+    def _load(self, key):
+        """读取缓存的节点结果，不存在时返回None"""
+        path = self._cache_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, key, node):
+        """原子写入节点结果"""
+        path = self._cache_path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(node, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _chunks(self, pdf_processor):
+        """按固定页数分块，返回 [(起始页码, 结束页码, 文本)]，跳过没有文字的页"""
+        chunks = []
+        for start in range(0, pdf_processor.total_pages, self.pages_per_chunk):
+            end = min(start + self.pages_per_chunk, pdf_processor.total_pages)
+            texts = []
+            for index in range(start, end):
+                text = pdf_processor.get_page(index)['text'].strip()
+                if text:
+                    texts.append(f"[第 {index + 1} 页]\n{text}")
+            if texts:
+                chunks.append((start + 1, end, '\n\n'.join(texts)))
+        return chunks
+
+    def _run_nodes(self, app, ai_processor, nodes, stats):
+        """
+        并行处理一层节点，已缓存的直接复用
+
+        Args:
+            nodes: [{'key', 'pages', 'text', 'instruction', 'task'}]
+
+        Returns:
+            list: 与 nodes 对应的结果 {'pages', 'content', 'usage'}
+
+        Raises:
+            DocumentError: 任一节点处理失败（携带第一个失败节点的原始错误结果）；
+            同一层已成功的节点先写入缓存，重试时不再重复调用
+        """
+        results = [self._load(node['key']) for node in nodes]
+        pending = [i for i, result in enumerate(results) if result is None]
+        stats['cached'] += len(nodes) - len(pending)
+
+        def run(index):
+            node = nodes[index]
+            with app.app_context():
+                return ai_processor.process_text(node['text'], node['instruction'], task=node['task'])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            responses = list(executor.map(run, pending))
+
+        failed = []
+        for index, response in zip(pending, responses):
+            if 'error' in response:
+                failed.append((index, response))
+                continue
+            node = {
+                'pages': nodes[index]['pages'],
+                'content': response['content'],
+                'usage': response.get('usage', {})
+            }
+            self._save(nodes[index]['key'], node)
+            results[index] = node
+            stats['calls'] += 1
+            stats['total_tokens'] += node['usage'].get('total_tokens', 0)
+
+        if failed:
+            index, response = failed[0]
+            pages = nodes[index]['pages']
+            raise DocumentError(
+                f"处理第 {pages[0]}-{pages[1]} 页时出错（本层共 {len(failed)} 个部分失败）: {response['error']}",
+                response
+            )
+        return results
+
+    def summarize(self, pdf_processor, prompt, session_key=None):
+        """
+        对整份文档执行 map-reduce 处理
+
+        Args:
+            pdf_processor: 文档的 PDFProcessor
+            prompt: 处理提示（通常是 PDF_PROMPTS 中的一项）
+            session_key: 调度时使用的会话标识
+
+        Returns:
+            dict: {'content', 'stats'}；stats 包含块数、层数、API调用数、缓存命中数和token数
+
+        Raises:
+            DocumentError: 某个节点处理失败
+        """
+        app = current_app._get_current_object()
+        ai_processor = AIProcessor(priority=BULK, session_key=session_key)
+        stats = {'chunks': 0, 'levels': 0, 'calls': 0, 'cached': 0, 'total_tokens': 0}
+
+        chunks = self._chunks(pdf_processor)
+        if not chunks:
+            return {'content': '', 'stats': stats}
+        stats['chunks'] = len(chunks)
+
+        # map：每块单独处理
+        nodes = [{
+            'key': _cache_key('map', prompt, text),
+            'pages': (start, end),
+            'text': f"以下是文档第 {start}-{end} 页的内容：\n\n{text}",
+            'instruction': prompt,
+            'task': 'page'
+        } for start, end, text in chunks]
+        level = self._run_nodes(app, ai_processor, nodes, stats)
+        stats['levels'] = 1
+
+        # reduce：逐层合并，直到只剩一个结果
+        reduce_instruction = DOC_REDUCE_PROMPT.format(prompt=prompt)
+        while len(level) > 1:
+            nodes = []
+            for i in range(0, len(level), self.fan_in):
+                group = level[i:i + self.fan_in]
+                if len(group) == 1:
+                    nodes.append(None)
+                    continue
+                text = '\n\n'.join(
+                    f"## 第 {part['pages'][0]}-{part['pages'][1]} 页的结果\n\n{part['content']}" for part in group
+                )
+                nodes.append({
+                    'key': _cache_key('reduce', prompt, text),
+                    'pages': (group[0]['pages'][0], group[-1]['pages'][1]),
+                    'text': text,
+                    'instruction': reduce_instruction,
+                    'task': 'document'
+                })
+            merged = iter(self._run_nodes(app, ai_processor, [n for n in nodes if n], stats))
+            # 落单的节点直接进入上一层
+            level = [
+                next(merged) if node else level[i * self.fan_in]
+                for i, node in enumerate(nodes)
+            ]
+            stats['levels'] += 1
+            logger.info(f"Document reduce level {stats['levels']}: {len(level)} nodes")
+
+        return {'content': level[0]['content'], 'stats': stats}
@@ -0,0 +1,173 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentHandle:
+    """
+    共享的已打开PDF文档
+
+    - doc 由所有引用它的会话共用，PyMuPDF 的文档对象不是线程安全的，访问时必须持有 lock
+    - normalizers 按规范化参数保存从该文档学到的页眉页脚规则，参数相同的会话共用，只需学习一次
+    """
+
+    def __init__(self, file_hash, file_path, data):
+        self.file_hash = file_hash
+        self.file_path = file_path
+        import fitz  # type: ignore  # 首次打开PDF时才加载，加快应用启动
+        # 从内存打开，上传同名文件覆盖磁盘文件时不影响已打开的文档
+        self.doc = fitz.open(stream=data, filetype='pdf')
+        self.size = len(data)
+        self.total_pages = len(self.doc)
+        self.lock = threading.RLock()
+        self.normalizers = {}
+        self.refcount = 0
+        self.last_used = time.monotonic()
+
+    def shared_normalizer(self, normalizer):
+        """
+        返回该文档共用的规范化器：参数相同的会话共用同一个实例（学到的页眉页脚规则只学习一次），
+        参数不同的调用方（例如检索和按配置处理的会话）各自使用自己的实例
+        """
+        key = (normalizer.edge_lines, normalizer.min_repeat_ratio, normalizer.min_repeat_pages)
+        with self.lock:
+            return self.normalizers.setdefault(key, normalizer)
+
+
+class DocumentPool:
+    """
+    PDF文档句柄池
+    用途：同一份PDF（按文件内容哈希识别）在所有会话间只打开和解析一次，
+    会话只保存自己的页码游标，新增会话几乎不再占用额外内存
+
+    - 引用计数：acquire 加一，release 减一
+    - 引用数降为0的文档不立即关闭，而是进入空闲队列，短时间内重新打开同一文件可直接复用
+    - 空闲文档超过 max_idle 个时按最近最少使用（LRU）顺序关闭
+
+    被调用位置：
+    - app/services/pdf_processor.py: 创建PDF处理器时获取文档
+    - app/routes/pdf.py: /scheduler-stats 返回文档池状态
+    """
+
+    def __init__(self, max_idle=8):
+        """
+        初始化文档池
+
+        Args:
+            max_idle: 最多保留的空闲（无会话引用）文档数
+        """
+        self.max_idle = max_idle
+        self._handles = {}          # 文件哈希 -> DocumentHandle
+        self._idle = OrderedDict()  # 空闲文档的文件哈希，按释放时间排序
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._reused = 0
+        self._closed = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建文档池"""
+        return cls(max_idle=config.get('DOC_POOL_MAX_IDLE', 8))
+
+    def acquire(self, file_path):
+        """
+        获取文件对应的共享文档，引用数加一
+
+        Args:
+            file_path: PDF文件路径
+
+        Returns:
+            DocumentHandle: 共享文档，使用完毕后必须调用 release
+        """
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        file_hash = hashlib.sha1(data).hexdigest()
+
+        with self._lock:
+            handle = self._handles.get(file_hash)
+            if handle is not None:
+                self._idle.pop(file_hash, None)
+                handle.refcount += 1
+                handle.last_used = time.monotonic()
+                self._reused += 1
+                logger.info(f"Reusing open document {file_hash[:10]} for {file_path} ({handle.refcount} refs)")
+                return handle
+
+        # 在池锁外解析文档，避免阻塞其他文件的获取
+        handle = DocumentHandle(file_hash, file_path, data)
+        with self._lock:
+            existing = self._handles.get(file_hash)
+            if existing is not None:
+                # 并发打开了同一文件，保留先放入池中的那份
+                handle.doc.close()
+                handle = existing
+                self._idle.pop(file_hash, None)
+                self._reused += 1
+            else:
+                self._handles[file_hash] = handle
+                self._opened += 1
+                logger.info(f"Opened document {file_hash[:10]} from {file_path} with {handle.total_pages} pages")
+            handle.refcount += 1
+            handle.last_used = time.monotonic()
+            return handle
+
+    def release(self, handle):
+        """
+        释放对文档的引用，引用数为0时放入空闲队列，超出 max_idle 时关闭最久未用的文档
+
+        Args:
+            handle: acquire 返回的文档
+        """
+        with self._lock:
+            handle.refcount -= 1
+            handle.last_used = time.monotonic()
+            if handle.refcount > 0:
+                return
+            self._idle[handle.file_hash] = handle
+            while len(self._idle) > self.max_idle:
+                file_hash, victim = self._idle.popitem(last=False)
+                del self._handles[file_hash]
+                with victim.lock:
+                    victim.doc.close()
+                self._closed += 1
+                logger.info(f"Closed idle document {file_hash[:10]} ({victim.file_path})")
+
+    def stats(self):
+        """返回文档池状态：各文档的引用数和空闲时间，以及打开、复用和关闭次数"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'open_documents': len(self._handles),
+                'idle_documents': len(self._idle),
+                'max_idle': self.max_idle,
+                'opened': self._opened,
+                'reused': self._reused,
+                'closed': self._closed,
+                'documents': [{
+                    'file': os.path.basename(handle.file_path),
+                    'hash': handle.file_hash[:10],
+                    'pages': handle.total_pages,
+                    'size_bytes': handle.size,
+                    'refcount': handle.refcount,
+                    'idle_seconds': round(now - handle.last_used, 1) if handle.refcount == 0 else 0
+                } for handle in self._handles.values()]
+            }
+
+
+# 共享的文档池，首次使用时根据配置创建
+_document_pool = None
+_document_pool_lock = threading.Lock()
+
+def get_document_pool():
+    """获取共享的PDF文档池"""
+    global _document_pool
+    with _document_pool_lock:
+        if _document_pool is None:
+            _document_pool = DocumentPool.from_config(current_app.config)
+        return _document_pool
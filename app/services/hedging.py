@@ -0,0 +1,122 @@
+import logging
+import threading
+from collections import deque
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    """
+    请求对冲策略
+    用途：上游请求耗时超过近期延迟的指定分位数（默认p95）时，再发一个相同的请求，
+    谁先成功返回就用谁，另一个取消，以削减长尾延迟
+
+    - 延迟阈值：最近 window 次成功请求耗时的分位数，样本不足 min_samples 时使用 default_delay
+    - 预算：对冲请求数不超过普通请求数的 budget_ratio，避免上游变慢时请求量翻倍
+
+    被调用位置：
+    - app/services/async_ai_processor.py: 发送请求时
+    - app/routes/pdf.py: /scheduler-stats 返回对冲统计
+    """
+
+    def __init__(self, percentile=0.95, min_delay=2.0, default_delay=10.0,
+                 budget_ratio=0.05, window=200, min_samples=20):
+        """
+        初始化对冲策略
+
+        Args:
+            percentile: 触发对冲的延迟分位数
+            min_delay: 对冲等待时间下限（秒）
+            default_delay: 样本不足时的对冲等待时间（秒）
+            budget_ratio: 对冲请求数占普通请求数的上限比例
+            window: 参与计算分位数的最近样本数
+            min_samples: 开始使用分位数前需要的最少样本数
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedges = 0
+        self._hedges_won = 0
+        self._denied = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建对冲策略，未启用时返回None"""
+        if not config.get('AI_HEDGE_ENABLED', False):
+            return None
+        return cls(
+            percentile=config.get('AI_HEDGE_PERCENTILE', 0.95),
+            min_delay=config.get('AI_HEDGE_MIN_DELAY', 2.0),
+            default_delay=config.get('AI_HEDGE_DEFAULT_DELAY', 10.0),
+            budget_ratio=config.get('AI_HEDGE_BUDGET', 0.05),
+        )
+
+    def delay(self):
+        """返回发出对冲请求前的等待时间（秒）"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.default_delay
+            ordered = sorted(self._latencies)
+        index = min(int(len(ordered) * self.percentile), len(ordered) - 1)
+        return max(ordered[index], self.min_delay)
+
+    def record(self, latency, hedged_won=False):
+        """记录一次成功请求的耗时（秒）"""
+        with self._lock:
+            self._latencies.append(latency)
+            if hedged_won:
+                self._hedges_won += 1
+
+    def on_request(self):
+        """记录一次普通请求，用于计算对冲预算"""
+        with self._lock:
+            self._requests += 1
+
+    def try_hedge(self):
+        """
+        申请发出一个对冲请求
+
+        Returns:
+            bool: 预算内返回True并计数，否则返回False
+        """
+        with self._lock:
+            if self._hedges + 1 > self._requests * self.budget_ratio:
+                self._denied += 1
+                return False
+            self._hedges += 1
+            return True
+
+    def stats(self):
+        """返回对冲统计：当前阈值、请求数、对冲数、对冲胜出数和因预算不足放弃的次数"""
+        delay = self.delay()
+        with self._lock:
+            return {
+                'delay_seconds': round(delay, 2),
+                'samples': len(self._latencies),
+                'requests': self._requests,
+                'hedges': self._hedges,
+                'hedges_won': self._hedges_won,
+                'denied_by_budget': self._denied,
+                'budget_ratio': self.budget_ratio
+            }
+
+
+# 共享的对冲策略（延迟样本和预算在所有请求间共享），首次使用时根据配置创建
+_hedge_policy = None
+_hedge_policy_loaded = False
+_hedge_policy_lock = threading.Lock()
+
+def get_hedge_policy():
+    """获取共享的对冲策略，未启用时返回None"""
+    global _hedge_policy, _hedge_policy_loaded
+    with _hedge_policy_lock:
+        if not _hedge_policy_loaded:
+            _hedge_policy = HedgePolicy.from_config(current_app.config)
+            _hedge_policy_loaded = True
+        return _hedge_policy
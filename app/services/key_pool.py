@@ -0,0 +1,201 @@
+import time
+import logging
+import threading
+from collections import deque
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# 每个密钥的用量统计窗口（秒）
+RATE_WINDOW = 60
+
+
+class NoAvailableKeyError(Exception):
+    """没有可用的API密钥（全部被隔离、冷却或达到速率上限）"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"暂无可用的API密钥，约 {retry_after} 秒后重试")
+
+
+def mask_key(key):
+    """日志和统计中只显示密钥首尾几位"""
+    return f"{key[:5]}...{key[-4:]}" if len(key) > 12 else '***'
+
+
+class _KeyState:
+    """单个密钥的用量和健康状态"""
+
+    def __init__(self, key):
+        self.key = key
+        self.in_flight = 0
+        self.requests = deque()  # 最近 RATE_WINDOW 秒内的请求时间
+        self.tokens = deque()    # 最近 RATE_WINDOW 秒内的 (时间, tokens)
+        self.unavailable_until = 0.0
+        self.reason = None       # 隔离或冷却原因
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.errors = 0
+
+    def trim(self, now):
+        """丢弃统计窗口之外的记录"""
+        while self.requests and now - self.requests[0] > RATE_WINDOW:
+            self.requests.popleft()
+        while self.tokens and now - self.tokens[0][0] > RATE_WINDOW:
+            self.tokens.popleft()
+
+    def window_tokens(self):
+        return sum(tokens for _, tokens in self.tokens)
+
+
+class KeyPool:
+    """
+    API密钥池
+    用途：把请求分散到多个API密钥上，总吞吐量不再受单个密钥的速率限制
+
+    - 每个密钥单独统计在途请求数、最近一分钟的请求数和token数
+    - 选择在途请求最少（其次最近请求最少）且未超出速率上限的健康密钥
+    - 鉴权失败（401/403）或额度用尽（402，或429且响应提示quota）的密钥自动隔离 quarantine_seconds
+    - 普通限流（429）只让该密钥冷却 Retry-After 秒（默认 cooldown_seconds）
+
+    被调用位置：
+    - app/services/ai_processor.py: 每次发送请求前选择密钥，请求结束后记录结果
+    - app/routes/pdf.py: /scheduler-stats 返回各密钥状态
+    """
+
+    def __init__(self, keys, requests_per_minute=0, tokens_per_minute=0,
+                 quarantine_seconds=600, cooldown_seconds=20):
+        """
+        初始化密钥池
+
+        Args:
+            keys: API密钥列表
+            requests_per_minute: 每个密钥每分钟请求数上限，0为不限制
+            tokens_per_minute: 每个密钥每分钟token数上限，0为不限制
+            quarantine_seconds: 鉴权或额度错误后的隔离时间（秒）
+            cooldown_seconds: 被限流且响应未给出 Retry-After 时的冷却时间（秒）
+        """
+        if not keys:
+            raise ValueError("KeyPool requires at least one API key")
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.quarantine_seconds = quarantine_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._states = [_KeyState(key) for key in dict.fromkeys(keys)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建密钥池"""
+        return cls(
+            config.get('API_KEYS') or [config['API_KEY']],
+            requests_per_minute=config.get('AI_KEY_RPM', 0),
+            tokens_per_minute=config.get('AI_KEY_TPM', 0),
+            quarantine_seconds=config.get('AI_KEY_QUARANTINE_SECONDS', 600),
+            cooldown_seconds=config.get('AI_KEY_COOLDOWN_SECONDS', 20),
+        )
+
+    def _wait_time(self, state, now):
+        """该密钥还需等待多久才可用，0 表示现在可用（调用方持有锁）"""
+        if state.unavailable_until > now:
+            return state.unavailable_until - now
+        state.trim(now)
+        wait = 0.0
+        if self.requests_per_minute and len(state.requests) >= self.requests_per_minute:
+            wait = max(wait, RATE_WINDOW - (now - state.requests[0]))
+        if self.tokens_per_minute and state.tokens and state.window_tokens() >= self.tokens_per_minute:
+            wait = max(wait, RATE_WINDOW - (now - state.tokens[0][0]))
+        return wait
+
+    def acquire(self):
+        """
+        选择一个密钥并登记在途请求
+
+        Returns:
+            str: 选中的密钥，请求结束后必须调用 release
+
+        Raises:
+            NoAvailableKeyError: 所有密钥都不可用
+        """
+        with self._lock:
+            now = time.monotonic()
+            waits = [(self._wait_time(state, now), state) for state in self._states]
+            healthy = [state for wait, state in waits if wait == 0]
+            if not healthy:
+                raise NoAvailableKeyError(max(int(min(wait for wait, _ in waits)), 1))
+            state = min(healthy, key=lambda s: (s.in_flight, len(s.requests)))
+            if state.reason:
+                logger.info(f"API key {mask_key(state.key)} available again")
+                state.reason = None
+            state.in_flight += 1
+            state.requests.append(now)
+            state.total_requests += 1
+            return state.key
+
+    def release(self, key, status_code=None, tokens=0, retry_after=None, body=''):
+        """
+        记录请求结果，按需隔离或冷却密钥
+
+        Args:
+            key: acquire 返回的密钥
+            status_code: HTTP状态码，超时或连接错误时为None
+            tokens: 本次消耗的token数
+            retry_after: 限流响应的 Retry-After 秒数
+            body: 错误响应内容，用于区分额度用尽和普通限流
+        """
+        with self._lock:
+            state = next(s for s in self._states if s.key == key)
+            now = time.monotonic()
+            state.in_flight -= 1
+            if tokens:
+                state.tokens.append((now, tokens))
+                state.total_tokens += tokens
+            if status_code in (401, 403, 402) or (status_code == 429 and 'quota' in (body or '').lower()):
+                state.errors += 1
+                state.unavailable_until = now + self.quarantine_seconds
+                state.reason = f"quarantined after HTTP {status_code}"
+                logger.warning(f"API key {mask_key(key)} {state.reason}")
+            elif status_code == 429:
+                state.errors += 1
+                state.unavailable_until = now + (retry_after or self.cooldown_seconds)
+                state.reason = 'rate limited'
+                logger.warning(f"API key {mask_key(key)} rate limited, cooling down")
+
+    @staticmethod
+    def is_key_error(status_code):
+        """该状态码是否由密钥本身引起（换一个密钥重试可能成功）"""
+        return status_code in (401, 402, 403, 429)
+
+    def stats(self):
+        """返回每个密钥的用量和状态"""
+        with self._lock:
+            now = time.monotonic()
+            result = []
+            for state in self._states:
+                wait = self._wait_time(state, now)
+                result.append({
+                    'key': mask_key(state.key),
+                    'available': wait == 0,
+                    'reason': state.reason if wait else None,
+                    'available_in': round(wait, 1),
+                    'in_flight': state.in_flight,
+                    'requests_last_minute': len(state.requests),
+                    'tokens_last_minute': state.window_tokens(),
+                    'total_requests': state.total_requests,
+                    'total_tokens': state.total_tokens,
+                    'errors': state.errors
+                })
+            return result
+
+
+# 共享的密钥池，首次使用时根据配置创建
+_key_pool = None
+_key_pool_lock = threading.Lock()
+
+def get_key_pool():
+    """获取共享的API密钥池"""
+    global _key_pool
+    with _key_pool_lock:
+        if _key_pool is None:
+            _key_pool = KeyPool.from_config(current_app.config)
+        return _key_pool
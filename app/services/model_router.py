@@ -0,0 +1,146 @@
+import logging
+import threading
+from flask import current_app
+from app.config.prompts import DEFAULT_PROMPTS, PDF_PROMPTS
+from app.utils.text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 模型档位
+FAST = 'fast'    # 低延迟的小模型
+LARGE = 'large'  # 质量优先的大模型
+AUTO = 'auto'    # 按输入长度在两者间选择
+
+# 各任务的默认路由：(模型档位, 输出/输入token比例, max_tokens下限, max_tokens上限)
+TASK_DEFAULTS = {
+    'chat': (AUTO, 1.0, 1024, 2000),         # 聊天：短消息用小模型；短问题也可能需要较长回答
+    'chat_summary': (FAST, 0.5, 256, 600),   # 聊天滚动摘要：输出不超过300字
+    'page': (LARGE, 1.5, 2000, 4000),        # 页面笔记生成：输出通常比输入长，短页面也不低于原来的2000
+    'document': (LARGE, 1.0, 2000, 4000),    # 整篇文档汇总
+}
+
+
+def parse_route_policy(policy):
+    """
+    解析路由配置字符串
+
+    Args:
+        policy: 格式为 "任务:档位,..."，如 "chat:fast,page:large"
+
+    Returns:
+        dict: 任务 -> 档位
+    """
+    result = {}
+    for item in (policy or '').split(','):
+        if not item.strip():
+            continue
+        task, _, tier = item.partition(':')
+        task, tier = task.strip(), tier.strip()
+        if tier not in (FAST, LARGE, AUTO):
+            raise ValueError(f"Invalid model tier '{tier}' for task '{task}'")
+        result[task] = tier
+    return result
+
+
+class ModelRouter:
+    """
+    模型路由服务类
+    用途：按任务类型和输入长度为每个请求选择模型档位并估算 max_tokens，
+    短聊天和摘要使用小模型获得更低延迟，笔记生成使用大模型
+
+    路由优先级（高到低）：
+    1. 提示模板中的 model_tier / max_tokens 字段（按提示内容匹配，见 app/config/prompts.py）
+    2. AI_ROUTE_POLICY 中按任务（路由）配置的档位
+    3. TASK_DEFAULTS 中的任务默认值；auto 档位在估算输入不超过 fast_input_tokens 时使用小模型
+
+    被调用位置：
+    - app/services/ai_processor.py: 构建请求体时
+    """
+
+    def __init__(self, fast_model, large_model, fast_input_tokens=400,
+                 policy=None, max_tokens_cap=4000, prompts=None):
+        """
+        初始化模型路由
+
+        Args:
+            fast_model: 小模型名称
+            large_model: 大模型名称
+            fast_input_tokens: auto 档位下使用小模型的最大估算输入token数
+            policy: 任务 -> 档位 的覆盖配置
+            max_tokens_cap: max_tokens 的全局上限
+            prompts: 提示模板列表，模板可带 model_tier / max_tokens 字段
+        """
+        self.models = {FAST: fast_model, LARGE: large_model}
+        self.fast_input_tokens = fast_input_tokens
+        self.policy = policy or {}
+        self.max_tokens_cap = max_tokens_cap
+        self.prompt_overrides = {}
+        for prompt in prompts or []:
+            options = {key: prompt[key] for key in ('model_tier', 'max_tokens') if key in prompt}
+            if options:
+                self.prompt_overrides[prompt['prompt'].strip()] = options
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建模型路由"""
+        return cls(
+            fast_model=config.get('AI_MODEL_FAST', 'claude-3-haiku-20240307'),
+            large_model=config.get('AI_MODEL_LARGE', 'claude-3-opus-20240229'),
+            fast_input_tokens=config.get('AI_ROUTE_FAST_INPUT_TOKENS', 400),
+            policy=parse_route_policy(config.get('AI_ROUTE_POLICY', '')),
+            max_tokens_cap=config.get('AI_MAX_TOKENS_CAP', 4000),
+            prompts=DEFAULT_PROMPTS + PDF_PROMPTS,
+        )
+
+    def route(self, task, input_tokens, instruction=''):
+        """
+        为一次请求选择模型和 max_tokens
+
+        Args:
+            task: 任务类型（chat / chat_summary / page / document）
+            input_tokens: 估算的输入token数（系统提示、历史和本次输入之和）
+            instruction: 系统提示，用于匹配提示模板中的路由配置
+
+        Returns:
+            dict: {'model', 'tier', 'max_tokens', 'task'}
+        """
+        tier, ratio, min_tokens, max_tokens = TASK_DEFAULTS.get(task, TASK_DEFAULTS['page'])
+        tier = self.policy.get(task, tier)
+        overrides = self.prompt_overrides.get((instruction or '').strip(), {})
+        tier = overrides.get('model_tier', tier)
+        if tier == AUTO:
+            tier = FAST if input_tokens <= self.fast_input_tokens else LARGE
+
+        if 'max_tokens' in overrides:
+            budget = overrides['max_tokens']
+        else:
+            budget = max(min_tokens, min(int(input_tokens * ratio), max_tokens))
+        budget = min(budget, self.max_tokens_cap)
+
+        return {
+            'model': self.models[tier],
+            'tier': tier,
+            'max_tokens': budget,
+            'task': task
+        }
+
+    @staticmethod
+    def estimate_input_tokens(text, instruction, history=None):
+        """估算一次请求的输入token数"""
+        return (
+            estimate_tokens(text) + estimate_tokens(instruction or '')
+            + sum(estimate_tokens(m['content']) for m in history or [])
+        )
+
+
+# 共享的模型路由，首次使用时根据配置创建
+_model_router = None
+_model_router_lock = threading.Lock()
+
+def get_model_router():
+    """获取共享的模型路由"""
+    global _model_router
+    with _model_router_lock:
+        if _model_router is None:
+            _model_router = ModelRouter.from_config(current_app.config)
+        return _model_router
@@ -0,0 +1,229 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+from flask import current_app
+from app.services import tracing
+
+logger = logging.getLogger(__name__)
+
+# 关闭时通知写入线程退出的标记
+_STOP = object()
+
+
+class OutputWriter:
+    """
+    后台输出写入服务类
+    用途：页面处理结果（.json / .md）不再在请求中同步写盘，而是放入队列，
+    由专门的写入线程批量写入，磁盘或网络存储较慢时不再拖慢每页的处理
+
+    - 队列有上限 max_queue，写入跟不上时 submit 阻塞等待（背压），不会无限占用内存
+    - 每批最多写 batch_size 个文件，每个文件先写临时文件再原子替换，可选 fsync
+    - 进程退出时（atexit）写完队列中剩余的文件再退出
+    - 每个会话的待写数、已写数、写入失败和写入耗时通过 status 查询，不影响处理流程
+
+    被调用位置：
+    - app/routes/pdf.py: 保存页面和整篇文档的处理结果，/output-status 查询写入状态
+    """
+
+    def __init__(self, max_queue=256, batch_size=32, fsync=True, history=100):
+        """
+        初始化写入器
+
+        Args:
+            max_queue: 队列中最多等待写入的文件数
+            batch_size: 每批最多写入的文件数
+            fsync: 写入后是否同步到磁盘
+            history: 每个会话保留的最近写入失败记录数
+        """
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._latencies = deque(maxlen=200)
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建写入器"""
+        return cls(
+            max_queue=config.get('OUTPUT_WRITER_MAX_QUEUE', 256),
+            batch_size=config.get('OUTPUT_WRITER_BATCH_SIZE', 32),
+            fsync=config.get('OUTPUT_WRITER_FSYNC', True),
+        )
+
+    def _session_status(self, session_id):
+        """返回会话的写入统计（调用方持有锁）"""
+        status = self._sessions.get(session_id)
+        if status is None:
+            status = self._sessions[session_id] = {
+                'pending': 0,
+                'written': 0,
+                'failed': 0,
+                'errors': deque(maxlen=self.history),
+                'last_write_ms': None,
+                'total_write_ms': 0.0
+            }
+        return status
+
+    def submit(self, session_id, path, content):
+        """
+        把一个文件放入写入队列，队列已满时阻塞等待
+
+        Args:
+            session_id: 文件所属会话，用于统计
+            path: 目标文件路径
+            content: 文件内容（字符串）
+        """
+        with self._lock:
+            self._session_status(session_id)['pending'] += 1
+        # 写入在后台线程中完成，记下提交时的span，写盘耗时记在它下面
+        self._queue.put((session_id, path, content, time.monotonic(), tracing.current_span()))
+
+    def _write(self, path, content):
+        """原子写入单个文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _run(self):
+        """写入线程：取出一批文件依次写入，收到退出标记后结束"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is _STOP:
+                    continue
+                session_id, path, content, queued_at, parent = item
+                started = time.monotonic()
+                error = None
+                try:
+                    with tracing.span('output.write', parent=parent, file=os.path.basename(path),
+                                      bytes=len(content), queued_ms=round((started - queued_at) * 1000, 1)):
+                        self._write(path, content)
+                except Exception as e:
+                    error = str(e)
+                    logger.error(f"Failed to write {path}: {error}")
+                took_ms = (time.monotonic() - started) * 1000
+                with self._lock:
+                    status = self._session_status(session_id)
+                    status['pending'] -= 1
+                    if error is None:
+                        status['written'] += 1
+                        status['last_write_ms'] = round(took_ms, 1)
+                        status['total_write_ms'] += took_ms
+                        self._written += 1
+                        self._latencies.append(took_ms)
+                    else:
+                        status['failed'] += 1
+                        status['errors'].append({
+                            'file_path': path,
+                            'error': error,
+                            'queued_seconds': round(started - queued_at, 3)
+                        })
+                        self._failed += 1
+            with self._lock:
+                self._batches += 1
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is _STOP:
+                return
+
+    def flush(self, timeout=None):
+        """
+        等待队列中已提交的文件全部写完
+
+        Returns:
+            bool: 是否在超时前写完
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        """写完剩余文件后停止写入线程"""
+        if not self._thread.is_alive():
+            return
+        pending = self._queue.qsize()
+        self._queue.put(_STOP)
+        self._thread.join()
+        logger.info(f"Output writer stopped after flushing {pending} queued files")
+
+    def status(self, session_id):
+        """
+        返回会话的写入状态
+
+        Returns:
+            dict: 待写数、已写数、失败数、最近失败记录、最近一次和平均写入耗时（毫秒）
+        """
+        with self._lock:
+            status = self._session_status(session_id)
+            return {
+                'pending': status['pending'],
+                'written': status['written'],
+                'failed': status['failed'],
+                'errors': list(status['errors']),
+                'last_write_ms': status['last_write_ms'],
+                'avg_write_ms': round(status['total_write_ms'] / status['written'], 1) if status['written'] else None
+            }
+
+    def forget(self, session_id):
+        """会话结束后丢弃其统计（仍在队列中的文件照常写入）"""
+        with self._lock:
+            status = self._sessions.get(session_id)
+            if status is not None and status['pending'] == 0:
+                del self._sessions[session_id]
+
+    def stats(self):
+        """返回整体写入统计：队列深度、批次数、已写和失败数、写入耗时"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'batches': self._batches,
+                'written': self._written,
+                'failed': self._failed,
+                'avg_write_ms': round(sum(latencies) / len(latencies), 1) if latencies else None,
+                'p95_write_ms': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 1) if latencies else None
+            }
+
+
+# 共享的写入器，首次使用时根据配置创建并注册退出时刷新
+_output_writer = None
+_output_writer_lock = threading.Lock()
+
+def get_output_writer():
+    """获取共享的后台输出写入器"""
+    global _output_writer
+    with _output_writer_lock:
+        if _output_writer is None:
+            _output_writer = OutputWriter.from_config(current_app.config)
+            atexit.register(_output_writer.close)
+        return _output_writer
@@ -0,0 +1,160 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 常见的页眉页脚/样板行：页码、"第N页"、"Page N of M"、版权声明、网址等
+BOILERPLATE_PATTERNS = [
+    re.compile(r'^[\s\-–—_.·]*\d{1,4}[\s\-–—_.·]*$'),
+    re.compile(r'^\s*第\s*\d+\s*页(\s*[/，,]?\s*共\s*\d+\s*页)?\s*$'),
+    re.compile(r'^\s*page\s*\d+(\s*(of|/)\s*\d+)?\s*$', re.IGNORECASE),
+    re.compile(r'^\s*\d+\s*/\s*\d+\s*$'),
+    re.compile(r'(©|copyright|版权所有)', re.IGNORECASE),
+    re.compile(r'^\s*(https?://|www\.)\S+\s*$', re.IGNORECASE),
+    re.compile(r'^[\W_]+$'),
+]
+
+# 默认策略：页面类别 -> 处理动作
+DEFAULT_POLICY = {
+    'blank': 'skip',
+    'boilerplate': 'skip',
+    'sparse': 'merge',
+    'low_density': 'flag',
+    'normal': 'process',
+}
+
+VALID_ACTIONS = ('process', 'skip', 'merge', 'flag')
+
+
+def parse_policy(policy_text):
+    """
+    解析策略字符串
+
+    Args:
+        policy_text: 形如 "blank:skip,sparse:merge" 的字符串
+
+    Returns:
+        dict: 合并默认策略后的 类别 -> 动作 映射
+    """
+    policy = dict(DEFAULT_POLICY)
+    for item in (policy_text or '').split(','):
+        if ':' not in item:
+            continue
+        category, action = (part.strip() for part in item.split(':', 1))
+        if category in policy and action in VALID_ACTIONS:
+            policy[category] = action
+        else:
+            logger.warning(f"Ignoring invalid triage policy entry: {item}")
+    return policy
+
+
+class PageTriage:
+    """
+    页面预筛选服务类
+    用途：在调用AI之前用本地规则对页面做廉价分类，避免为空白页、封面页、
+    只有页眉页脚的页面消耗API时间和tokens
+
+    页面类别：
+    - blank: 几乎没有文字（如扫描页）
+    - boilerplate: 大部分行是页码、页眉页脚等样板内容
+    - sparse: 文字过少，适合合并到下一页一起处理
+    - low_density: 有效字符占比过低（如目录点线、乱码）
+    - normal: 正常页面
+
+    处理动作：
+    - process: 正常发送给AI
+    - skip: 跳过，不调用AI
+    - merge: 暂存文本，与后续页面合并后再处理
+    - flag: 正常处理，但在结果中标记
+
+    被调用位置：
+    - app/routes/pdf.py: process_page / process_batch / process_range
+    """
+
+    def __init__(self, min_chars=20, sparse_chars=80, min_density=0.3,
+                 max_boilerplate=0.8, policy=None):
+        """
+        初始化页面预筛选器
+
+        Args:
+            min_chars: 有效字符数低于该值视为空白页
+            sparse_chars: 有效字符数低于该值视为稀疏页
+            min_density: 有效字符占全部字符的最低比例
+            max_boilerplate: 样板行占比超过该值视为样板页
+            policy: 类别 -> 动作 映射，默认使用 DEFAULT_POLICY
+        """
+        self.min_chars = min_chars
+        self.sparse_chars = sparse_chars
+        self.min_density = min_density
+        self.max_boilerplate = max_boilerplate
+        self.policy = dict(policy or DEFAULT_POLICY)
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建预筛选器"""
+        return cls(
+            min_chars=config.get('PAGE_TRIAGE_MIN_CHARS', 20),
+            sparse_chars=config.get('PAGE_TRIAGE_SPARSE_CHARS', 80),
+            min_density=config.get('PAGE_TRIAGE_MIN_DENSITY', 0.3),
+            max_boilerplate=config.get('PAGE_TRIAGE_MAX_BOILERPLATE', 0.8),
+            policy=parse_policy(config.get('PAGE_TRIAGE_POLICY', '')),
+        )
+
+    @staticmethod
+    def _is_boilerplate(line):
+        """判断单行是否为样板内容"""
+        return any(pattern.search(line) for pattern in BOILERPLATE_PATTERNS)
+
+    def classify(self, text):
+        """
+        对页面文本进行分类
+
+        Args:
+            text: 页面文本
+
+        Returns:
+            dict: 包含类别和各项统计指标
+        """
+        text = text or ''
+        char_count = sum(1 for c in text if c.isalnum())
+        density = char_count / len(text) if text else 0.0
+
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        boilerplate_lines = sum(1 for line in lines if self._is_boilerplate(line))
+        boilerplate_ratio = boilerplate_lines / len(lines) if lines else 0.0
+
+        if char_count < self.min_chars:
+            category = 'blank'
+        elif boilerplate_ratio >= self.max_boilerplate:
+            category = 'boilerplate'
+        elif char_count < self.sparse_chars:
+            category = 'sparse'
+        elif density < self.min_density:
+            category = 'low_density'
+        else:
+            category = 'normal'
+
+        return {
+            'category': category,
+            'char_count': char_count,
+            'density': round(density, 3),
+            'boilerplate_ratio': round(boilerplate_ratio, 3),
+        }
+
+    def decide(self, text, is_last_page=False):
+        """
+        根据策略决定页面的处理动作
+
+        Args:
+            text: 页面文本
+            is_last_page: 是否为本次处理的最后一页（最后一页无法再合并）
+
+        Returns:
+            dict: classify() 的结果，外加 action 字段
+        """
+        decision = self.classify(text)
+        action = self.policy.get(decision['category'], 'process')
+        if action == 'merge' and is_last_page:
+            action = 'process'
+        decision['action'] = action
+        return decision
@@ -1,5 +1,6 @@
-import fitz # type: ignore
 import logging
+import threading
+from app.services import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -13,30 +14,101 @@ class PDFProcessor:
     - 逐页提取文本
     - 追踪处理进度
     
+    使用文档池时，文档由打开同一文件的所有处理器共享，处理器只保存自己的页码游标
+    
     被调用位置：
     - app/routes/pdf.py: 处理PDF文件上传和文本提取
+    - app/services/retriever.py: 切分文档建立检索索引
     """
 
-    def __init__(self, file_path):
+    # 学习页眉页脚时最多抽样的页数
+    NORMALIZE_SAMPLE_PAGES = 50
+
+    def __init__(self, file_path, normalizer=None, pool=None):
         """
         初始化PDF处理器
         
         Args:
             file_path: PDF文件路径
+            normalizer: 可选的TextNormalizer，用于去除页眉页脚并压缩空白
+            pool: 可选的DocumentPool；提供时从池中获取共享文档，
+                同一文档已有学习好的规范化器时沿用该规范化器
             
         设置：
-        - 打开PDF文档
+        - 打开PDF文档（或从文档池获取）
         - 获取总页数
         - 初始化页面计数器
         - 初始化文本缓存
         """
         self.file_path = file_path
-        self.doc = fitz.open(file_path)
+        self.pool = pool
+        if pool is not None:
+            self.handle = pool.acquire(file_path)
+            self.file_hash = self.handle.file_hash
+            self.doc = self.handle.doc
+            self._doc_lock = self.handle.lock
+            if normalizer is not None:
+                normalizer = self.handle.shared_normalizer(normalizer)
+        else:
+            self.handle = None
+            self.file_hash = None
+            import fitz  # type: ignore  # 首次打开PDF时才加载，加快应用启动
+            self.doc = fitz.open(file_path)
+            self._doc_lock = threading.RLock()
         self.total_pages = len(self.doc)
         self.current_page = 0
         self.extracted_text = ""
+        self.normalizer = normalizer
         logger.info(f"Initialized PDF processor for {file_path} with {self.total_pages} pages")
 
+    def _ensure_normalizer(self):
+        """首次取页时从均匀抽样的页面中学习页眉页脚"""
+        if self.normalizer is None or self.normalizer.learned:
+            return
+        with self._doc_lock:
+            # 共享文档的规范化器可能已由其他会话学习完成
+            if self.normalizer.learned:
+                return
+            step = max(1, self.total_pages // self.NORMALIZE_SAMPLE_PAGES)
+            indexes = range(0, self.total_pages, step)
+            with tracing.span('pdf.learn_normalizer', pages=len(indexes)):
+                self.normalizer.learn(
+                    [self.doc[i].get_text() for i in indexes],
+                    page_numbers=[i + 1 for i in indexes]
+                )
+
+    def get_page(self, page_index):
+        """
+        获取指定页的文本内容（不改变当前页码）
+        
+        Args:
+            page_index: 从0开始的页面下标
+            
+        Returns:
+            dict: 包含页面信息和文本内容的字典；启用规范化时附带 normalization 统计，
+            页码越界时返回None
+        """
+        if not 0 <= page_index < self.total_pages:
+            return None
+        
+        with tracing.span('pdf.extract', page=page_index + 1) as span:
+            with self._doc_lock:
+                text = self.doc[page_index].get_text()
+            page_info = {
+                'page_number': page_index + 1,
+                'total_pages': self.total_pages,
+                'text': text
+            }
+            
+            if self.normalizer is not None:
+                self._ensure_normalizer()
+                result = self.normalizer.normalize(text, page_number=page_index + 1)
+                page_info['text'] = result.pop('text')
+                page_info['normalization'] = result
+                logger.info(f"Normalized page {page_index + 1}: saved {result['tokens_saved']} tokens")
+            span.set(chars=len(page_info['text']))
+        return page_info
+
     def get_next_page(self):
         """
         获取下一页的文本内容
@@ -49,17 +121,11 @@ class PDFProcessor:
         - 更新处理进度信息
         - 返回页面元数据
         """
-        if self.current_page < self.total_pages:
-            page = self.doc[self.current_page]
-            self.extracted_text = page.get_text()
-            page_info = {
-                'page_number': self.current_page + 1,
-                'total_pages': self.total_pages,
-                'text': self.extracted_text
-            }
+        page_info = self.get_page(self.current_page)
+        if page_info:
+            self.extracted_text = page_info['text']
             logger.info(f"Extracted text from page {self.current_page + 1}")
-            return page_info
-        return None
+        return page_info
 
     def close(self):
         """
@@ -72,7 +138,15 @@ class PDFProcessor:
         调用时机：
         - PDF处理完成后
         - 发生错误需要清理时
+        
+        使用文档池时只释放引用，文档由池决定何时关闭；重复调用无副作用
         """
+        if self.pool is not None:
+            if self.handle is not None:
+                self.pool.release(self.handle)
+                self.handle = None
+                logger.info("PDF document released to pool")
+            return
         self.doc.close()
         logger.info("PDF document closed")
 
@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _text_key(prompt, text):
+    """提示和页面文本的联合哈希，只有两者都一致时预取结果才能使用"""
+    digest = hashlib.sha1()
+    digest.update((prompt or '').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((text or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PagePrefetcher:
+    """
+    页面结果预取器
+    用途：交互处理时，在用户阅读第N页结果的同时用当前提示提前处理后续页面，
+    用户点击处理下一页时可直接拿到结果
+
+    每个PDF会话一个实例，保存 页面下标 -> 在途请求(concurrent.futures.Future)；
+    请求运行在 AsyncAIProcessor 的共享事件循环上，取消 Future 会同时中止上游HTTP请求
+
+    被调用位置：
+    - app/routes/pdf.py: /process-page 调度和领取预取结果；跳页、跳转、批量处理时取消
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def is_scheduled(self, page_index, prompt):
+        """该页是否已用相同提示在预取"""
+        with self._lock:
+            entry = self._entries.get(page_index)
+            return entry is not None and entry['prompt'] == prompt
+
+    def add(self, page_index, prompt, text, future):
+        """登记一个预取请求，替换该页已有的预取"""
+        with self._lock:
+            old = self._entries.pop(page_index, None)
+            self._entries[page_index] = {
+                'prompt': prompt,
+                'key': _text_key(prompt, text),
+                'future': future
+            }
+        if old:
+            old['future'].cancel()
+
+    def take(self, page_index, prompt, text):
+        """
+        领取某页的预取请求
+
+        Args:
+            page_index: 页面下标
+            prompt: 本次实际使用的提示
+            text: 本次实际要发送的文本（预筛选合并后可能与预取时不同）
+
+        Returns:
+            Future: 提示和文本都一致时返回预取请求，否则取消该预取并返回None
+        """
+        with self._lock:
+            entry = self._entries.pop(page_index, None)
+        if entry is None:
+            return None
+        if entry['key'] != _text_key(prompt, text):
+            entry['future'].cancel()
+            logger.info(f"Discarded stale prefetch for page {page_index + 1}")
+            return None
+        return entry['future']
+
+    def cancel_all(self, reason=''):
+        """取消所有预取请求（跳页、跳转、换提示时调用）"""
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for entry in entries.values():
+            entry['future'].cancel()
+        if entries:
+            logger.info(f"Cancelled {len(entries)} prefetches{': ' + reason if reason else ''}")
+
+    def cancel_other_prompts(self, prompt):
+        """取消使用其他提示的预取请求"""
+        with self._lock:
+            stale = [i for i, entry in self._entries.items() if entry['prompt'] != prompt]
+            entries = [self._entries.pop(i) for i in stale]
+        for entry in entries:
+            entry['future'].cancel()
+        if entries:
+            logger.info(f"Cancelled {len(entries)} prefetches after prompt change")
+
+    def pending(self):
+        """返回正在预取的页码（从1开始）"""
+        with self._lock:
+            return sorted(i + 1 for i in self._entries)
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """
+    采样分析器
+    用途：每隔 interval 秒记录一次所有线程的调用栈，统计各函数出现的次数，
+    找出一个慢请求的时间花在了文本提取、上游请求、重试等待、JSON序列化还是写盘上
+
+    - 异步视图运行在单独的事件循环线程中，上游请求运行在共享的AI事件循环线程中，
+      因此采样所有线程而不只是处理请求的线程；每条调用栈以线程名开头
+    - 结果为折叠栈格式（"线程;函数;函数 次数"），可直接交给 flamegraph.pl / speedscope 生成火焰图
+    - 只用标准库，开销与采样间隔有关，不采样时没有任何开销
+
+    被调用位置：
+    - app/routes/debug.py: 请求带 X-Profile 请求头或 profile 查询参数时
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        初始化采样分析器
+
+        Args:
+            interval: 采样间隔（秒）
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+    def _sample(self):
+        """记录一次所有线程（除自身外）的调用栈"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        """开始采样"""
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止采样"""
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def collapsed(self):
+        """返回折叠栈格式的文本"""
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+    def top(self, limit=30):
+        """
+        按函数汇总
+
+        Returns:
+            list: [{'function', 'self', 'total'}]；self 为位于栈顶的采样数，total 为出现在栈中的采样数
+        """
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            # 去掉行号，同一函数的不同行合并统计
+            functions = [frame.rsplit(':', 1)[0] + ')' if ':' in frame else frame for frame in stack[1:]]
+            if functions:
+                self_counts[functions[-1]] += count
+            for function in set(functions):
+                total_counts[function] += count
+        return [{
+            'function': function,
+            'self': self_counts[function],
+            'total': count
+        } for function, count in total_counts.most_common(limit)]
+
+    def save(self, folder, name, meta):
+        """
+        保存分析结果：<name>.json（元数据和函数汇总）和 <name>.folded（折叠栈）
+
+        Returns:
+            str: json 文件路径
+        """
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"{name}.folded"), 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        path = os.path.join(folder, f"{name}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(
+                meta,
+                duration_seconds=round(self.duration, 3),
+                interval_seconds=self.interval,
+                samples=self.samples,
+                top=self.top()
+            ), f, ensure_ascii=False, indent=2)
+        return path
+
+
+class MemoryTracker:
+    """
+    内存快照对比
+    用途：用 tracemalloc 定期对比两次快照，找出哪些代码位置分配的内存在持续增长
+    （例如 pdf_sessions 中越积越多的会话数据）
+
+    首次调用 snapshot_diff 时才开始跟踪，之前没有任何开销；跟踪开始后所有内存分配都会变慢，
+    排查结束后应调用 stop
+
+    被调用位置：
+    - app/routes/debug.py: /debug/memory
+    """
+
+    def __init__(self, frames=10):
+        """
+        Args:
+            frames: 每次分配记录的调用栈深度
+        """
+        self.frames = frames
+        self._previous = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _snapshot():
+        """拍摄快照，排除 tracemalloc 自身和模块导入的分配（基线和后续快照使用相同过滤）"""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    def snapshot_diff(self, limit=20, group_by='lineno'):
+        """
+        拍摄快照并与上一次快照对比
+
+        Returns:
+            dict: 首次调用时只开始跟踪；之后返回增长最多的分配位置、当前和峰值内存
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._previous = self._snapshot()
+                return {'started': True, 'message': 'tracemalloc started, call again to get a diff'}
+
+            snapshot = self._snapshot()
+            stats = snapshot.compare_to(self._previous, group_by)
+            self._previous = snapshot
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                'started': False,
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top': [{
+                    'location': str(stat.traceback[-1] if group_by == 'traceback' else stat.traceback[0]),
+                    'traceback': stat.traceback.format()[-self.frames:] if group_by == 'traceback' else None,
+                    'size_diff_bytes': stat.size_diff,
+                    'size_bytes': stat.size,
+                    'count_diff': stat.count_diff,
+                    'count': stat.count
+                } for stat in stats[:limit]]
+            }
+
+    def stop(self):
+        """停止跟踪"""
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
@@ -0,0 +1,167 @@
+import os
+import math
+import logging
+import threading
+from collections import Counter, OrderedDict
+from flask import current_app
+from app.services.pdf_processor import PDFProcessor
+from app.services.document_pool import get_document_pool
+from app.services.text_normalizer import TextNormalizer
+from app.utils.text_utils import estimate_tokens, tokenize_terms
+
+logger = logging.getLogger(__name__)
+
+# 已切分文件的缓存：绝对路径 -> (修改时间, 文本块列表)，按最近最少使用顺序淘汰，
+# 最多保留 CHAT_RETRIEVAL_CACHE_FILES 个文件
+_chunk_cache = OrderedDict()
+_chunk_cache_lock = threading.Lock()
+
+
+class BM25Retriever:
+    """
+    本地BM25检索服务类
+    用途：为 /chat 的检索模式从用户上传的PDF中挑选最相关的页面片段，
+    在token预算内拼接为参考资料，让回答有据可依且提示长度可控
+
+    工作方式：
+    - 每个PDF按页切分（过长的页再按段落切分为不超过 chunk_tokens 的片段），结果按文件修改时间缓存，
+      最多缓存 CHAT_RETRIEVAL_CACHE_FILES 个文件（LRU）
+    - 查询时用 BM25 为所有片段打分，按分数从高到低选取，直到达到 top_k 或token预算
+
+    被调用位置：
+    - app/routes/chat.py: 检索模式的聊天请求
+    """
+
+    def __init__(self, chunk_tokens=800, k1=1.5, b=0.75):
+        """
+        初始化检索器
+
+        Args:
+            chunk_tokens: 单个片段的最大估算token数
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+        """
+        self.chunk_tokens = chunk_tokens
+        self.k1 = k1
+        self.b = b
+
+    def _split_page(self, text):
+        """把过长的页面按段落切分为不超过 chunk_tokens 的片段"""
+        if estimate_tokens(text) <= self.chunk_tokens:
+            return [text]
+        chunks, current, current_tokens = [], [], 0
+        for line in text.splitlines():
+            line_tokens = estimate_tokens(line)
+            if current and current_tokens + line_tokens > self.chunk_tokens:
+                chunks.append('\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            chunks.append('\n'.join(current))
+        return chunks
+
+    def _load_chunks(self, file_path):
+        """读取并切分PDF，返回带词频统计的片段列表"""
+        path = os.path.abspath(file_path)
+        mtime = os.path.getmtime(file_path)
+        with _chunk_cache_lock:
+            cached = _chunk_cache.get(path)
+            if cached is not None and cached[0] == mtime:
+                _chunk_cache.move_to_end(path)
+                return cached[1]
+
+        processor = PDFProcessor(
+            file_path, normalizer=TextNormalizer.from_config(current_app.config), pool=get_document_pool()
+        )
+        chunks = []
+        try:
+            for index in range(processor.total_pages):
+                page_info = processor.get_page(index)
+                for text in self._split_page(page_info['text']):
+                    terms = tokenize_terms(text)
+                    if not terms:
+                        continue
+                    chunks.append({
+                        'source_file': os.path.basename(file_path),
+                        'page_number': page_info['page_number'],
+                        'text': text,
+                        'tokens': estimate_tokens(text),
+                        'term_freqs': Counter(terms),
+                        'length': len(terms)
+                    })
+        finally:
+            processor.close()
+
+        with _chunk_cache_lock:
+            # 同一路径的旧版本直接被替换
+            _chunk_cache[path] = (mtime, chunks)
+            _chunk_cache.move_to_end(path)
+            while len(_chunk_cache) > current_app.config.get('CHAT_RETRIEVAL_CACHE_FILES', 32):
+                _chunk_cache.popitem(last=False)
+        logger.info(f"Indexed {len(chunks)} chunks from {file_path} for retrieval")
+        return chunks
+
+    def retrieve(self, query, file_paths, top_k=5, token_budget=3000):
+        """
+        检索与查询最相关的片段
+
+        Args:
+            query: 用户问题
+            file_paths: 参与检索的PDF路径列表
+            top_k: 最多返回的片段数
+            token_budget: 返回片段的估算token总数上限
+
+        Returns:
+            list: 按相关度排序的片段，每项包含来源文件、页码、文本、token数和分数
+        """
+        query_terms = set(tokenize_terms(query))
+        if not query_terms:
+            return []
+
+        chunks = []
+        for file_path in file_paths:
+            try:
+                chunks.extend(self._load_chunks(file_path))
+            except Exception as e:
+                logger.error(f"Failed to load {file_path} for retrieval: {str(e)}")
+        if not chunks:
+            return []
+
+        # BM25 打分
+        total = len(chunks)
+        avg_length = sum(chunk['length'] for chunk in chunks) / total
+        doc_freqs = {
+            term: sum(1 for chunk in chunks if term in chunk['term_freqs'])
+            for term in query_terms
+        }
+        scored = []
+        for chunk in chunks:
+            score = 0.0
+            for term in query_terms:
+                freq = chunk['term_freqs'].get(term, 0)
+                if not freq:
+                    continue
+                idf = math.log(1 + (total - doc_freqs[term] + 0.5) / (doc_freqs[term] + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * chunk['length'] / avg_length)
+                score += idf * freq * (self.k1 + 1) / (freq + norm)
+            if score > 0:
+                scored.append((score, chunk))
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        # 在token预算内按分数依次选取
+        selected, used_tokens = [], 0
+        for score, chunk in scored:
+            if len(selected) >= top_k:
+                break
+            if used_tokens + chunk['tokens'] > token_budget:
+                continue
+            used_tokens += chunk['tokens']
+            selected.append({
+                'source_file': chunk['source_file'],
+                'page_number': chunk['page_number'],
+                'text': chunk['text'],
+                'tokens': chunk['tokens'],
+                'score': round(score, 4)
+            })
+        return selected
@@ -0,0 +1,252 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, CancelledError
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别，按顺序调度：交互请求总是先于批量请求获得上游并发名额
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+
+
+class RequestCancelled(Exception):
+    """排队中的请求被取消"""
+
+
+class _Ticket:
+    """一次上游请求的排队凭证"""
+
+    def __init__(self, priority, session_key):
+        self.priority = priority
+        self.session_key = session_key
+        self.future = Future()  # 获得名额时完成
+        self.queued_at = time.monotonic()
+        self.state = 'queued'  # queued / running / done / cancelled（被 cancel() 取消）
+
+
+class RequestScheduler:
+    """
+    上游请求调度器
+    用途：所有发往AI接口的请求（同步和异步）都先在这里排队获取并发名额，
+    避免一个会话的大批量处理占满上游并发，拖慢其他用户的聊天和单页处理
+
+    调度规则：
+    - 优先级：有交互请求排队时总是先放行交互请求
+    - 预留：批量请求最多占用 max_concurrency - interactive_reserve 个名额，
+      剩余名额只给交互请求，因此批量任务跑满时交互请求也无需等待
+    - 公平：同一优先级内按会话轮转放行，每个会话轮流获得一个名额
+    - 取消：cancel(session_key) 取消该会话所有仍在排队的请求，并标记该会话已取消：
+      之后提交的请求直接被取消，直到 clear_cancelled(session_key)，
+      批量/范围处理通过 is_cancelled() 在每页前检查
+
+    名额通过 concurrent.futures.Future 发放，同步代码用 acquire()/release()，
+    异步代码 await asyncio.wrap_future(ticket.future)
+
+    被调用位置：
+    - app/services/ai_processor.py: process_text
+    - app/services/async_ai_processor.py: 异步请求
+    - app/routes/pdf.py: 取消排队请求、查询调度状态
+    """
+
+    def __init__(self, max_concurrency=20, interactive_reserve=2):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrency: 同时在途的上游请求上限
+            interactive_reserve: 只留给交互请求的名额数
+        """
+        self.max_concurrency = max_concurrency
+        self.interactive_reserve = min(interactive_reserve, max_concurrency - 1)
+        self._lock = threading.Lock()
+        # 优先级 -> {会话: 排队凭证队列}，OrderedDict 的顺序即轮转顺序
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._cancelled = set()  # 已取消、尚未恢复的会话
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self._stats = {
+            priority: {'completed': 0, 'cancelled': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for priority in PRIORITIES
+        }
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建调度器"""
+        return cls(
+            max_concurrency=config.get('AI_MAX_CONCURRENCY', 20),
+            interactive_reserve=config.get('AI_INTERACTIVE_RESERVE', 2),
+        )
+
+    def submit(self, priority=INTERACTIVE, session_key=None):
+        """
+        请求一个并发名额，立即返回排队凭证
+
+        Returns:
+            _Ticket: ticket.future 在获得名额时完成，被取消时抛出 CancelledError
+            （会话已取消时返回的凭证已被取消）；用完后必须调用 release(ticket)
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        ticket = _Ticket(priority, session_key)
+        with self._lock:
+            if session_key is not None and session_key in self._cancelled:
+                ticket.state = 'cancelled'
+                ticket.future.cancel()
+                self._stats[priority]['cancelled'] += 1
+                return ticket
+            self._queues[priority].setdefault(session_key, deque()).append(ticket)
+            self._dispatch()
+        return ticket
+
+    def acquire(self, priority=INTERACTIVE, session_key=None):
+        """
+        同步等待并发名额
+
+        Raises:
+            RequestCancelled: 排队期间被取消
+        """
+        ticket = self.submit(priority, session_key)
+        try:
+            ticket.future.result()
+        except CancelledError:
+            self.release(ticket)
+            raise RequestCancelled('请求在排队时被取消')
+        return ticket
+
+    def release(self, ticket):
+        """
+        归还名额或撤销排队，可重复调用
+        """
+        with self._lock:
+            if ticket.state == 'queued':
+                self._remove(ticket)
+                ticket.future.cancel()
+                self._stats[ticket.priority]['cancelled'] += 1
+            elif ticket.state == 'running':
+                self._running[ticket.priority] -= 1
+                self._stats[ticket.priority]['completed'] += 1
+            ticket.state = 'done'
+            self._dispatch()
+
+    def cancel(self, session_key, priority=None):
+        """
+        取消某个会话仍在排队的请求（已在执行的请求不受影响），
+        并拒绝该会话之后提交的请求，直到调用 clear_cancelled()
+
+        Args:
+            session_key: 会话标识
+            priority: 只取消该优先级的请求，None 表示全部
+
+        Returns:
+            int: 取消的请求数
+        """
+        cancelled = 0
+        with self._lock:
+            if session_key is not None:
+                self._cancelled.add(session_key)
+            for level in PRIORITIES:
+                if priority and level != priority:
+                    continue
+                for ticket in self._queues[level].pop(session_key, ()):
+                    ticket.state = 'cancelled'
+                    ticket.future.cancel()
+                    self._stats[level]['cancelled'] += 1
+                    cancelled += 1
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} queued requests for session {session_key}")
+        return cancelled
+
+    def is_cancelled(self, session_key):
+        """会话是否已被 cancel() 取消且尚未恢复"""
+        with self._lock:
+            return session_key in self._cancelled
+
+    def clear_cancelled(self, session_key):
+        """清除会话的取消标记，之后提交的请求正常排队"""
+        with self._lock:
+            self._cancelled.discard(session_key)
+
+    def _remove(self, ticket):
+        """从排队队列中移除凭证（调用方持有锁）"""
+        queues = self._queues[ticket.priority]
+        queue = queues.get(ticket.session_key)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del queues[ticket.session_key]
+
+    def _has_capacity(self, priority):
+        """当前是否还能放行该优先级的请求（调用方持有锁）"""
+        running = sum(self._running.values())
+        if priority == BULK:
+            return running < self.max_concurrency - self.interactive_reserve
+        return running < self.max_concurrency
+
+    def _dispatch(self):
+        """按优先级和会话轮转放行排队的请求（调用方持有锁）"""
+        for priority in PRIORITIES:
+            queues = self._queues[priority]
+            while queues and self._has_capacity(priority):
+                session_key, queue = next(iter(queues.items()))
+                ticket = queue.popleft()
+                # 该会话移到队尾，下一个名额轮到其他会话
+                del queues[session_key]
+                if queue:
+                    queues[session_key] = queue
+                # 等待方已经放弃（例如异步任务被取消）时跳过
+                if not ticket.future.set_running_or_notify_cancel():
+                    ticket.state = 'done'
+                    self._stats[priority]['cancelled'] += 1
+                    continue
+                ticket.state = 'running'
+                self._running[priority] += 1
+                wait = time.monotonic() - ticket.queued_at
+                stats = self._stats[priority]
+                stats['wait_total'] += wait
+                stats['wait_max'] = max(stats['wait_max'], wait)
+                ticket.future.set_result(ticket)
+
+    def stats(self):
+        """
+        返回调度状态
+
+        Returns:
+            dict: 每个优先级的排队数、执行数、完成/取消数和平均/最大排队等待时间，
+            以及每个会话的排队数
+        """
+        with self._lock:
+            result = {
+                'max_concurrency': self.max_concurrency,
+                'interactive_reserve': self.interactive_reserve,
+            }
+            for priority in PRIORITIES:
+                stats = self._stats[priority]
+                started = stats['completed'] + self._running[priority]
+                result[priority] = {
+                    'queued': sum(len(q) for q in self._queues[priority].values()),
+                    'running': self._running[priority],
+                    'completed': stats['completed'],
+                    'cancelled': stats['cancelled'],
+                    'avg_wait_ms': round(stats['wait_total'] / started * 1000, 1) if started else 0.0,
+                    'max_wait_ms': round(stats['wait_max'] * 1000, 1),
+                    'sessions': {
+                        str(key): len(q) for key, q in self._queues[priority].items()
+                    }
+                }
+            return result
+
+
+# 共享的调度器，首次使用时根据配置创建
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """获取共享的上游请求调度器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler.from_config(current_app.config)
+        return _scheduler
@@ -0,0 +1,276 @@
+import os
+import re
+import html
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符逐字切分后再交给 FTS5 的 unicode61 分词器，否则整句中文会被当成一个词
+CJK_CHAR_PATTERN = re.compile(r'([㐀-䶿一-鿿豈-﫿])')
+NOTE_PAGE_PATTERN = re.compile(r'page_(\d+)\.md$')
+
+# 共享索引实例，按数据库路径区分
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def segment_text(text):
+    """在每个中日韩字符两侧插入空格，使其成为独立的检索词"""
+    return CJK_CHAR_PATTERN.sub(r' \1 ', text or '')
+
+
+class SearchIndex:
+    """
+    本地全文检索索引
+    用途：基于 SQLite FTS5 为所有上传的PDF页面和 uploads/outputs 中生成的笔记
+    建立全文索引，按 bm25 排序返回带高亮片段和页码跳转链接的结果
+
+    索引方式：
+    - PDF 按页建立条目，笔记按 page_N.md 文件建立条目
+    - documents 表记录每个文件的修改时间和大小，refresh() 只重建有变化的文件
+    - 建立索引（提取整份PDF）在后台线程中进行（refresh_in_background），
+      检索只查询已建立的索引，不在请求中等待
+
+    被调用位置：
+    - app/routes/search.py: /search 接口（查询并按间隔触发后台扫描）
+    - app/routes/pdf.py: 上传PDF后立即触发后台扫描
+    """
+
+    def __init__(self, db_path, upload_folder, refresh_interval=30):
+        """
+        初始化检索索引
+
+        Args:
+            db_path: SQLite 数据库文件路径
+            upload_folder: PDF上传目录，笔记位于其下的 outputs 目录
+            refresh_interval: 两次增量扫描之间的最小间隔（秒）
+        """
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self.refresh_interval = refresh_interval
+        self._last_refresh = 0
+        self._refresh_lock = threading.Lock()
+        self._background_lock = threading.Lock()
+        self._background_running = False
+        self._background_rerun = False  # 后台扫描进行中又收到强制扫描请求时，结束后再扫一次
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._create_tables()
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置获取共享的索引实例"""
+        db_path = os.path.join(config.get('INDEX_FOLDER', 'uploads/index'), 'search.sqlite3')
+        with _indexes_lock:
+            if db_path not in _indexes:
+                _indexes[db_path] = cls(
+                    db_path,
+                    config['UPLOAD_FOLDER'],
+                    refresh_interval=config.get('SEARCH_REFRESH_INTERVAL', 30)
+                )
+            return _indexes[db_path]
+
+    def _connect(self):
+        """每次操作使用独立连接，避免跨线程共享"""
+        return sqlite3.connect(self.db_path)
+
+    def _create_tables(self):
+        """创建索引表"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    path TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+                    path UNINDEXED,
+                    kind UNINDEXED,
+                    page_number UNINDEXED,
+                    content UNINDEXED,
+                    body
+                )
+            """)
+
+    def _scan_files(self):
+        """列出当前需要索引的文件：(相对路径, 类别)"""
+        files = []
+        if os.path.isdir(self.upload_folder):
+            for name in os.listdir(self.upload_folder):
+                if name.lower().endswith('.pdf'):
+                    files.append((name, 'pdf'))
+        outputs_dir = os.path.join(self.upload_folder, 'outputs')
+        for root, _, names in os.walk(outputs_dir):
+            for name in names:
+                if NOTE_PAGE_PATTERN.search(name):
+                    path = os.path.relpath(os.path.join(root, name), self.upload_folder)
+                    files.append((path.replace(os.sep, '/'), 'note'))
+        return files
+
+    def _extract_pages(self, path, kind):
+        """提取文件内容，返回 (页码, 文本) 列表"""
+        full_path = os.path.join(self.upload_folder, path)
+        if kind == 'pdf':
+            import fitz  # type: ignore  # 首次建立索引时才加载
+            with fitz.open(full_path) as doc:
+                return [(i + 1, page.get_text()) for i, page in enumerate(doc)]
+        with open(full_path, 'r', encoding='utf-8') as f:
+            return [(int(NOTE_PAGE_PATTERN.search(path).group(1)), f.read())]
+
+    def refresh(self, force=False):
+        """
+        增量更新索引：新增或修改的文件重新索引，已删除的文件移出索引
+
+        Args:
+            force: 忽略 refresh_interval 立即扫描
+
+        Returns:
+            int: 本次重新索引的文件数
+        """
+        if not force and time.time() - self._last_refresh < self.refresh_interval:
+            return 0
+        with self._refresh_lock:
+            updated = 0
+            with self._connect() as conn:
+                known = {
+                    row[0]: (row[1], row[2])
+                    for row in conn.execute("SELECT path, mtime, size FROM documents")
+                }
+                seen = set()
+                for path, kind in self._scan_files():
+                    seen.add(path)
+                    try:
+                        stat = os.stat(os.path.join(self.upload_folder, path))
+                        if known.get(path) == (stat.st_mtime, stat.st_size):
+                            continue
+                        pages = self._extract_pages(path, kind)
+                    except Exception as e:
+                        logger.error(f"Failed to index {path}: {str(e)}")
+                        continue
+                    conn.execute("DELETE FROM pages WHERE path = ?", (path,))
+                    conn.executemany(
+                        "INSERT INTO pages (path, kind, page_number, content, body) VALUES (?, ?, ?, ?, ?)",
+                        [(path, kind, number, text, segment_text(text)) for number, text in pages if text.strip()]
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO documents (path, kind, mtime, size) VALUES (?, ?, ?, ?)",
+                        (path, kind, stat.st_mtime, stat.st_size)
+                    )
+                    updated += 1
+                for path in set(known) - seen:
+                    conn.execute("DELETE FROM pages WHERE path = ?", (path,))
+                    conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+            self._last_refresh = time.time()
+        if updated:
+            logger.info(f"Search index refreshed: {updated} files re-indexed")
+        return updated
+
+    @property
+    def indexing(self):
+        """后台扫描是否正在进行（此时检索结果可能还不包含新文件）"""
+        return self._background_running
+
+    def refresh_in_background(self, force=False):
+        """
+        在后台线程中执行 refresh()，立即返回
+
+        Args:
+            force: 忽略 refresh_interval；后台扫描进行中时，结束后再扫描一次以包含新文件
+
+        Returns:
+            bool: 是否启动了新的后台扫描
+        """
+        if not force and time.time() - self._last_refresh < self.refresh_interval:
+            return False
+        with self._background_lock:
+            if self._background_running:
+                self._background_rerun = self._background_rerun or force
+                return False
+            self._background_running = True
+        threading.Thread(target=self._background_refresh, name='search-index', daemon=True).start()
+        return True
+
+    def _background_refresh(self):
+        """后台扫描线程：扫描直到没有新的强制扫描请求"""
+        while True:
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                logger.error(f"Background search index refresh failed: {str(e)}")
+            with self._background_lock:
+                if not self._background_rerun:
+                    self._background_running = False
+                    return
+                self._background_rerun = False
+
+    @staticmethod
+    def _query_terms(query):
+        """把用户查询拆分为检索词；中文按字切分后作为短语匹配"""
+        terms = []
+        for word in (query or '').replace('"', ' ').split():
+            tokens = segment_text(word).split()
+            if tokens:
+                terms.append(' '.join(tokens))
+        return terms
+
+    @staticmethod
+    def _highlight(text, terms, width=80):
+        """从原文中截取首个命中位置附近的片段，并用 <mark> 标记命中词"""
+        patterns = [re.escape(term.replace(' ', '')) for term in terms]
+        matcher = re.compile('|'.join(patterns), re.IGNORECASE) if patterns else None
+        flat = ' '.join(text.replace('\u200b', '').split())
+        first = matcher.search(flat) if matcher else None
+        start = max(0, first.start() - width // 2) if first else 0
+        excerpt = flat[start:start + width]
+
+        pieces, last = [], 0
+        for match in (matcher.finditer(excerpt) if matcher else ()):
+            pieces.append(html.escape(excerpt[last:match.start()]))
+            pieces.append(f"<mark>{html.escape(match.group())}</mark>")
+            last = match.end()
+        pieces.append(html.escape(excerpt[last:]))
+        prefix = '…' if start > 0 else ''
+        suffix = '…' if start + width < len(flat) else ''
+        return prefix + ''.join(pieces) + suffix
+
+    def search(self, query, limit=20, kind=None):
+        """
+        检索索引
+
+        Args:
+            query: 查询文本，多个词之间为"与"关系
+            limit: 最多返回条数
+            kind: 可选，只检索 pdf 或 note
+
+        Returns:
+            list: 按相关度排序的结果，每项包含路径、类别、页码、高亮片段和分数
+        """
+        terms = self._query_terms(query)
+        if not terms:
+            return []
+        match_expr = ' '.join(f'"{term}"' for term in terms)
+        sql = "SELECT path, kind, page_number, content, bm25(pages) AS score FROM pages WHERE pages MATCH ?"
+        params = [match_expr]
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {
+                'path': path,
+                'kind': row_kind,
+                'page_number': page_number,
+                'snippet': self._highlight(content, terms),
+                'score': round(-score, 4)
+            }
+            for path, row_kind, page_number, content, score in rows
+        ]
@@ -0,0 +1,183 @@
+import re
+import logging
+from collections import Counter
+from app.utils.text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 零宽字符（部分PDF在每行末尾带有\u200b等不可见字符）
+ZERO_WIDTH_PATTERN = re.compile('[\u200b\u200c\u200d\ufeff]')
+# 英文单词在行尾被连字符断开，如 "infor-\nmation"
+HYPHEN_BREAK_PATTERN = re.compile(r'([A-Za-z])-\n\s*([a-z])')
+# 可能是页码的单独一行，如 "12"、"- 12 -"、"第 3 页"、"Page 3 of 10"；
+# 只有印刷页码随页面递增（与页面序号相差固定值）时才当作页码删除
+PAGE_NUMBER_PATTERN = re.compile(
+    r'^\s*(?:[\-–—]?\s*(\d{1,4})\s*[\-–—]?|第\s*(\d+)\s*页.*|page\s*(\d+)(?:\s*(?:of|/)\s*\d+)?|(\d+)\s*/\s*\d+)\s*$',
+    re.IGNORECASE
+)
+
+
+class TextNormalizer:
+    """
+    文本规范化服务类
+    用途：在页面文本发送给AI之前去掉跨页重复的页眉页脚、页码，
+    合并连字符断词并压缩空白，以减少输入tokens
+
+    工作方式：
+    - learn(): 统计文档中每页首尾若干行的出现次数，出现页数足够多、
+      且几乎不出现在页面中部的行视为页眉页脚（避免误删重复的题干）；
+      同时检查首尾行中的数字是否随页面递增，是则记下印刷页码与页面序号的差值
+    - normalize(): 删除页眉页脚和符合该差值的页码行（首尾行中其他数字如年份、答案保留），
+      合并断词，压缩行内空白，连续空行合并为一个以保留段落分隔，并返回节省的tokens
+
+    被调用位置：
+    - app/services/pdf_processor.py: 提取页面文本时
+    """
+
+    def __init__(self, edge_lines=3, min_repeat_ratio=0.6, min_repeat_pages=3):
+        """
+        初始化文本规范化器
+
+        Args:
+            edge_lines: 每页首尾各检查多少行作为页眉页脚候选
+            min_repeat_ratio: 一行至少在多大比例的页面中出现才视为页眉页脚
+            min_repeat_pages: 一行至少在多少页中出现才视为页眉页脚
+        """
+        self.edge_lines = edge_lines
+        self.min_repeat_ratio = min_repeat_ratio
+        self.min_repeat_pages = min_repeat_pages
+        self.repeated_lines = set()
+        self.page_number_offset = None  # 印刷页码 - 页面序号，未发现递增页码时为None
+        self.learned = False
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建规范化器，未启用时返回None"""
+        if not config.get('TEXT_NORMALIZE_ENABLED', True):
+            return None
+        return cls(
+            edge_lines=config.get('TEXT_NORMALIZE_EDGE_LINES', 3),
+            min_repeat_ratio=config.get('TEXT_NORMALIZE_MIN_REPEAT_RATIO', 0.6),
+        )
+
+    @staticmethod
+    def _clean_line(line):
+        """去掉零宽字符并压缩行内空白"""
+        return ' '.join(ZERO_WIDTH_PATTERN.sub('', line).split())
+
+    def _line_key(self, line):
+        """
+        生成行的比较键
+        
+        数字保留不做归一：日期、题号等带数字的行往往是正文，
+        单独成行的页码由 _page_label 和 page_number_offset 处理
+        """
+        return self._clean_line(line)
+
+    @staticmethod
+    def _page_label(line):
+        """行的形式像页码时返回其中的数字，否则返回None"""
+        match = PAGE_NUMBER_PATTERN.match(line)
+        if not match:
+            return None
+        return int(next(group for group in match.groups() if group is not None))
+
+    def _edge_indexes(self, lines):
+        """返回首尾 edge_lines 行在非空行列表中的下标"""
+        count = len(lines)
+        head = range(min(self.edge_lines, count))
+        tail = range(max(count - self.edge_lines, 0), count)
+        return set(head) | set(tail)
+
+    def learn(self, page_texts, page_numbers=None):
+        """
+        从文档各页文本中学习重复出现的页眉页脚和页码规律
+
+        Args:
+            page_texts: 页面文本列表（可以是抽样的部分页面）
+            page_numbers: 与 page_texts 对应的页面序号（从1开始），不提供时不学习页码
+        """
+        edge_counter = Counter()
+        interior_counter = Counter()
+        offset_counter = Counter()
+        page_count = 0
+        for position, text in enumerate(page_texts):
+            lines = [line for line in (text or '').splitlines() if self._clean_line(line)]
+            if not lines:
+                continue
+            page_count += 1
+            edge_indexes = self._edge_indexes(lines)
+            edge_counter.update({self._line_key(lines[i]) for i in edge_indexes})
+            interior_counter.update({
+                self._line_key(line) for i, line in enumerate(lines) if i not in edge_indexes
+            })
+            if page_numbers is not None:
+                labels = {self._page_label(lines[i]) for i in edge_indexes} - {None}
+                offset_counter.update({label - page_numbers[position] for label in labels})
+
+        threshold = max(self.min_repeat_pages, self.min_repeat_ratio * page_count)
+        self.repeated_lines = {
+            key for key, count in edge_counter.items()
+            if count >= threshold and interior_counter[key] <= count * 0.1
+        }
+        # 首尾行中的数字与页面序号的差值在足够多的页面上相同，才认为是递增的页码
+        offset, count = offset_counter.most_common(1)[0] if offset_counter else (None, 0)
+        self.page_number_offset = offset if count >= threshold else None
+        self.learned = True
+        logger.info(f"Learned {len(self.repeated_lines)} repeated header/footer lines from {page_count} pages"
+                    f" (page number offset: {self.page_number_offset})")
+
+    def _is_page_number(self, line, page_number):
+        """该行是否为本页的印刷页码"""
+        if self.page_number_offset is None or page_number is None:
+            return False
+        return self._page_label(line) == page_number + self.page_number_offset
+
+    def normalize(self, text, page_number=None):
+        """
+        规范化单页文本
+
+        Args:
+            text: 原始页面文本
+            page_number: 页面序号（从1开始），用于识别本页的印刷页码
+
+        Returns:
+            dict: 包含规范化后的文本(text)、规范化前后的估算tokens、节省的tokens和删除的行数
+        """
+        text = text or ''
+        lines = [line for line in text.splitlines() if self._clean_line(line)]
+        edge_indexes = self._edge_indexes(lines)
+        removed_indexes = {
+            index for index in edge_indexes
+            if self._line_key(lines[index]) in self.repeated_lines or self._is_page_number(lines[index], page_number)
+        }
+
+        kept = []
+        index = 0
+        blank = False
+        for line in text.splitlines():
+            cleaned = self._clean_line(line)
+            if not cleaned:
+                # 连续空行合并为一个，保留段落分隔
+                blank = bool(kept)
+                continue
+            index += 1
+            if index - 1 in removed_indexes:
+                continue
+            if blank:
+                kept.append('')
+                blank = False
+            kept.append(cleaned)
+        removed = len(removed_indexes)
+
+        normalized = HYPHEN_BREAK_PATTERN.sub(r'\1\2', '\n'.join(kept)).strip()
+
+        tokens_before = estimate_tokens(text)
+        tokens_after = estimate_tokens(normalized)
+        return {
+            'text': normalized,
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'tokens_saved': tokens_before - tokens_after,
+            'removed_lines': removed,
+        }
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# 子span自动继承的属性，用于按会话和页码关联一次处理中的所有操作
+INHERITED_ATTRS = ('session_id', 'page')
+
+# 当前线程/协程中正在进行的span；通过 contextvars 传递，
+# 随 run_coroutine_threadsafe 提交到共享AI事件循环的请求也能拿到
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """一次被计时的操作：名称、所属trace、父span、开始时间、耗时和属性"""
+
+    def __init__(self, tracer, name, parent=None, attrs=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = {key: parent.attrs[key] for key in INHERITED_ATTRS if parent and key in parent.attrs}
+        self.attrs.update({key: value for key, value in (attrs or {}).items() if value is not None})
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.error = None
+
+    def set(self, **attrs):
+        """补充属性（如状态码、token数）"""
+        self.attrs.update(attrs)
+
+    def end(self):
+        """结束并导出"""
+        self.tracer.export({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round((time.perf_counter() - self._started) * 1000, 3),
+            'thread': threading.current_thread().name,
+            'error': self.error,
+            'attrs': self.attrs
+        })
+
+
+class _NoopSpan:
+    """未启用追踪时返回的空span"""
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    请求追踪服务类
+    用途：记录一页从路由、PDF提取、调度排队、每次上游请求尝试到结果写盘的各段耗时，
+    每个span都带有会话ID和页码，慢页面可以逐个拆开查看时间花在哪里
+
+    - span 以 JSON Lines 格式追加写入本地文件，超过 max_bytes 时轮转为 .1 文件
+    - /traces 按会话查询，/traces/view 以瀑布图显示
+
+    被调用位置：
+    - app/routes/pdf.py: 每页处理
+    - app/services/pdf_processor.py: 页面文本提取
+    - app/services/ai_processor.py / async_ai_processor.py: 调度排队和每次请求尝试
+    - app/services/output_writer.py: 结果写盘
+    """
+
+    def __init__(self, path, max_bytes=20 * 1024 * 1024):
+        """
+        初始化追踪
+
+        Args:
+            path: JSONL 导出文件路径
+            max_bytes: 文件超过该大小时轮转
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建追踪，未启用时返回None"""
+        if not config.get('TRACING_ENABLED', False):
+            return None
+        return cls(
+            config.get('TRACE_FILE', os.path.join('uploads', 'traces', 'spans.jsonl')),
+            max_bytes=config.get('TRACE_MAX_BYTES', 20 * 1024 * 1024),
+        )
+
+    def export(self, record):
+        """追加写入一个span"""
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            try:
+                self._file.write(line)
+                self._file.flush()
+                if self._file.tell() > self.max_bytes:
+                    self._file.close()
+                    os.replace(self.path, f"{self.path}.1")
+                    self._file = open(self.path, 'a', encoding='utf-8')
+            except Exception as e:
+                logger.error(f"Failed to export span: {str(e)}")
+
+    def read(self, session_id=None, trace_id=None):
+        """读取导出的span（含轮转前的文件），可按会话或trace过滤"""
+        spans = []
+        with self._lock:
+            self._file.flush()
+            for path in (f"{self.path}.1", self.path):
+                if not os.path.exists(path):
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            span = json.loads(line)
+                        except ValueError:
+                            continue
+                        if session_id and span['attrs'].get('session_id') != session_id:
+                            continue
+                        if trace_id and span['trace_id'] != trace_id:
+                            continue
+                        spans.append(span)
+        return spans
+
+    def traces(self, session_id=None, limit=50):
+        """
+        按trace分组
+
+        Returns:
+            list: 最近的 limit 个trace，每个包含根span信息和按开始时间排序的所有span
+        """
+        grouped = {}
+        for span in self.read(session_id=session_id):
+            grouped.setdefault(span['trace_id'], []).append(span)
+        result = []
+        for trace_id, spans in grouped.items():
+            spans.sort(key=lambda s: s['start'])
+            root = next((s for s in spans if s['parent_id'] is None), spans[0])
+            start = min(s['start'] for s in spans)
+            end = max(s['start'] + s['duration_ms'] / 1000 for s in spans)
+            result.append({
+                'trace_id': trace_id,
+                'name': root['name'],
+                'attrs': root['attrs'],
+                'start': start,
+                'duration_ms': round((end - start) * 1000, 3),
+                'error': next((s['error'] for s in spans if s['error']), None),
+                'spans': spans
+            })
+        result.sort(key=lambda t: t['start'], reverse=True)
+        return result[:limit]
+
+
+# 共享的追踪，首次在应用上下文中使用时根据配置创建
+_tracer = None
+_tracer_loaded = False
+_tracer_lock = threading.Lock()
+
+def get_tracer():
+    """获取共享的追踪，未启用（或尚未在应用上下文中初始化）时返回None"""
+    global _tracer, _tracer_loaded
+    if _tracer_loaded:
+        return _tracer
+    if not has_app_context():
+        return None
+    with _tracer_lock:
+        if not _tracer_loaded:
+            _tracer = Tracer.from_config(current_app.config)
+            _tracer_loaded = True
+        return _tracer
+
+
+def current_span():
+    """返回当前的span，没有时返回None"""
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, parent=None, **attrs):
+    """
+    记录一段操作的耗时
+
+    用法：
+        with tracing.span('ai.attempt', attempt=1) as s:
+            ...
+            s.set(status_code=200)
+
+    Args:
+        name: 操作名称
+        parent: 父span，默认为当前span；在其他线程中继续一个操作时显式传入
+        **attrs: 属性；session_id / page 会被子span继承
+
+    Yields:
+        Span: 未启用追踪时为不做任何事的空span
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield NOOP_SPAN
+        return
+    current = Span(tracer, name, parent if parent is not None else _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
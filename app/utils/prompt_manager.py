@@ -1,80 +1,174 @@
 import os
 import json
-from flask import current_app
+import hashlib
+import logging
+import threading
+from flask import current_app, has_app_context
 from app.config.prompts import PDF_PROMPTS  # 使用 prompts.py 中的提示
 
+logger = logging.getLogger(__name__)
+
+# 用户添加的提示，每行一个JSON对象，只追加不改写
+USER_PROMPTS_FILE = 'user_prompts.jsonl'
+# 旧版本整体改写的用户提示文件（JSON数组），只读取不再写入
+LEGACY_USER_PROMPTS_FILE = 'user_prompts.json'
+
+
 class PromptManager:
     """
     提示管理器
-    用于管理和加载PDF处理的提示模板
+    用途：管理PDF处理的提示模板，合并内置提示（app/config/prompts.py）和用户添加的提示
+
+    - 按ID建立索引，get_prompt_by_id 不再逐个查找
+    - 用户提示以 JSON Lines 追加写入 user_prompts.jsonl，每次添加只追加一行，不改写已有内容；
+      读取时跳过不完整的行（例如写入中途进程退出）
+    - 每次读取前检查用户提示文件的修改时间和大小，其他进程（如另一个服务实例）添加的提示会自动加载
+    - version 为合并后所有提示内容的哈希，提示不变时保持不变，可作为缓存键的一部分
+
+    被调用位置：
+    - app/routes/chat.py 和 app/routes/pdf.py: 通过 get_prompt_manager() 共享同一个实例
+    - pdf_process_cli.py: 按ID选择提示
     """
-    def __init__(self):
-        self.prompts = PDF_PROMPTS
-        self.prompts_dir = 'prompts'
-        self._ensure_prompts_dir()
-        self._ensure_default_prompts()
-
-    def _ensure_prompts_dir(self):
-        """确保prompts目录存在"""
-        if not os.path.exists(self.prompts_dir):
-            os.makedirs(self.prompts_dir)
-
-    def _ensure_default_prompts(self):
-        """创建默认提示模板"""
-        default_prompts = [
-            {
-                "id": 1,
-                "name": "标准笔记转换",
-                "description": "将PDF内容转换为结构化的markdown笔记",
-                "prompt": "请将这段文本转换为详细的markdown格式笔记，包含标题、要点和补充说明。"
-            },
-            {
-                "id": 2,
-                "name": "关键概念提取",
-                "description": "提取文本中的关键概念和定义",
-                "prompt": "请从文本中提取所有关键概念和定义，以markdown格式列出，并添加简短解释。"
-            },
-            # 可以添加更多默认提示
-        ]
-        
-        default_file = os.path.join(self.prompts_dir, 'default_prompts.json')
-        if not os.path.exists(default_file):
-            with open(default_file, 'w', encoding='utf-8') as f:
-                json.dump(default_prompts, f, ensure_ascii=False, indent=2)
+
+    def __init__(self, prompts_dir='prompts'):
+        """
+        初始化提示管理器
+
+        Args:
+            prompts_dir: 用户提示文件所在目录（添加第一个提示时才创建）
+        """
+        self.prompts_dir = prompts_dir
+        self._lock = threading.RLock()
+        self._mtimes = None
+        self._prompts = []
+        self._by_id = {}
+        self.version = None
+        self._reload_if_changed()
+
+    @classmethod
+    def from_config(cls, config):
+        """根据Flask配置创建提示管理器"""
+        return cls(config.get('PROMPTS_FOLDER', 'prompts'))
+
+    @property
+    def _user_file(self):
+        return os.path.join(self.prompts_dir, USER_PROMPTS_FILE)
+
+    @property
+    def _legacy_file(self):
+        return os.path.join(self.prompts_dir, LEGACY_USER_PROMPTS_FILE)
+
+    def _file_state(self):
+        """用户提示文件的（修改时间, 大小），用于判断是否需要重新加载"""
+        state = []
+        for path in (self._legacy_file, self._user_file):
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _load_user_prompts(self):
+        """读取用户提示：旧版 JSON 数组文件在前，JSON Lines 文件在后"""
+        prompts = []
+        if os.path.exists(self._legacy_file):
+            try:
+                with open(self._legacy_file, 'r', encoding='utf-8') as f:
+                    prompts.extend(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load {self._legacy_file}: {str(e)}")
+        if os.path.exists(self._user_file):
+            with open(self._user_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        prompts.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"Skipping incomplete line in {self._user_file}")
+        return prompts
+
+    def _reload_if_changed(self):
+        """用户提示文件有变化时重新建立索引"""
+        state = self._file_state()
+        if state == self._mtimes:
+            return
+        with self._lock:
+            if state == self._mtimes:
+                return
+            by_id = {}
+            for prompt in list(PDF_PROMPTS) + self._load_user_prompts():
+                # 同一ID出现多次时以后出现的为准
+                by_id[int(prompt['id'])] = prompt
+            self._prompts = list(by_id.values())
+            self._by_id = by_id
+            self.version = hashlib.sha1(
+                json.dumps(self._prompts, ensure_ascii=False, sort_keys=True).encode('utf-8')
+            ).hexdigest()[:12]
+            self._mtimes = state
+            logger.info(f"Loaded {len(self._prompts)} prompts (version {self.version})")
 
     def get_all_prompts(self):
-        """获取所有PDF处理提示"""
-        return self.prompts
+        """获取所有PDF处理提示（内置提示在前，用户提示按添加顺序在后）"""
+        self._reload_if_changed()
+        return self._prompts
 
     def get_prompt_by_id(self, prompt_id):
-        """根据ID获取提示"""
-        return next((p for p in self.prompts if p['id'] == int(prompt_id)), None)
+        """根据ID获取提示，不存在或ID无效时返回None"""
+        self._reload_if_changed()
+        try:
+            return self._by_id.get(int(prompt_id))
+        except (TypeError, ValueError):
+            return None
 
     def add_prompt(self, name, description, prompt_text):
-        """添加新的提示模板"""
-        prompts = self.get_all_prompts()
-        new_id = max([p['id'] for p in prompts], default=0) + 1
-        
-        new_prompt = {
-            "id": new_id,
-            "name": name,
-            "description": description,
-            "prompt": prompt_text
-        }
-        
-        user_file = os.path.join(self.prompts_dir, 'user_prompts.json')
-        existing_prompts = []
-        if os.path.exists(user_file):
-            with open(user_file, 'r', encoding='utf-8') as f:
-                existing_prompts = json.load(f)
-        
-        existing_prompts.append(new_prompt)
-        
-        with open(user_file, 'w', encoding='utf-8') as f:
-            json.dump(existing_prompts, f, ensure_ascii=False, indent=2)
-        
-        return new_prompt
+        """
+        添加新的提示模板（追加一行到 user_prompts.jsonl）
+
+        Returns:
+            dict: 新的提示，包含分配的ID
+        """
+        with self._lock:
+            # 先加载其他进程可能已添加的提示，避免分配重复的ID
+            self._reload_if_changed()
+            new_prompt = {
+                "id": max(self._by_id, default=0) + 1,
+                "name": name,
+                "description": description,
+                "prompt": prompt_text
+            }
+
+            os.makedirs(self.prompts_dir, exist_ok=True)
+            line = (json.dumps(new_prompt, ensure_ascii=False) + '\n').encode('utf-8')
+            # O_APPEND 下单次 write 整行写入，不会与其他写入交错，也不会改写已有内容
+            fd = os.open(self._user_file, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if size and os.pread(fd, 1, size - 1) != b'\n':
+                    # 上一次写入中途中断留下了不完整的行，新行另起一行
+                    line = b'\n' + line
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            self._reload_if_changed()
+            return new_prompt
 
     def get_default_prompt(self):
         """获取默认提示"""
-        return self.prompts[0]['prompt'] 
\ No newline at end of file
+        return self.get_all_prompts()[0]['prompt']
+
+
+# 共享的提示管理器，首次使用时根据配置创建
+_prompt_manager = None
+_prompt_manager_lock = threading.Lock()
+
+def get_prompt_manager():
+    """获取共享的提示管理器（不在应用上下文中时使用默认目录）"""
+    global _prompt_manager
+    with _prompt_manager_lock:
+        if _prompt_manager is None:
+            _prompt_manager = PromptManager.from_config(current_app.config if has_app_context() else {})
+        return _prompt_manager
@@ -0,0 +1,50 @@
+import re
+
+# 中日韩文字及全角标点，大致按每个字符一个token估算
+CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿豈-﫿＀-￯]')
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数量
+
+    Args:
+        text: 要估算的文本
+
+    Returns:
+        int: 估算的token数（中日韩字符按1个token计，其余按每4个字符1个token计）
+
+    用途：
+    - 统计文本规范化节省的tokens（app/services/text_normalizer.py）
+    - 控制检索上下文的token预算（app/services/retriever.py）
+    """
+    if not text:
+        return 0
+    cjk_count = len(CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+# 英文单词/数字，以及连续的中日韩字符
+WORD_PATTERN = re.compile(r'[a-z0-9]+|[㐀-䶿一-鿿豈-﫿]+')
+
+def tokenize_terms(text):
+    """
+    把文本切分为检索词
+
+    Args:
+        text: 要切分的文本
+
+    Returns:
+        list: 英文按单词切分（小写），中文按相邻两字切分（单字成词时保留单字）
+
+    用途：
+    - BM25 检索打分（app/services/retriever.py）
+    """
+    terms = []
+    for word in WORD_PATTERN.findall((text or '').lower()):
+        if word[0].isascii():
+            terms.append(word)
+        elif len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
@@ -1,6 +1,5 @@
 import os
 from dotenv import load_dotenv # type: ignore
-import requests
 import logging
 
 # 加载.env文件中的环境变量
@@ -23,9 +22,19 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     
     # 从环境变量获取API密钥
-    API_KEY = os.getenv('API_KEY', '').strip()
-    if not API_KEY:
-        raise ValueError("API_KEY must be set in .env file")
+    # API_KEYS 可配置多个密钥（逗号分隔）组成密钥池，未设置时只使用 API_KEY
+    API_KEYS = [key.strip() for key in os.getenv('API_KEYS', '').split(',') if key.strip()]
+    # 未设置时不在导入时报错，由 create_app 启动时的 validate_config 检查，
+    # 导入配置（例如 gunicorn --preload、命令行 --list-prompts）不需要环境变量
+    API_KEY = os.getenv('API_KEY', '').strip() or (API_KEYS[0] if API_KEYS else '')
+    if not API_KEYS and API_KEY:
+        API_KEYS = [API_KEY]
+    # 每个密钥每分钟的请求数和token数上限（0为不限制），
+    # 鉴权或额度错误后的隔离秒数，被限流且响应未给出 Retry-After 时的冷却秒数
+    AI_KEY_RPM = int(os.getenv('AI_KEY_RPM', '0'))
+    AI_KEY_TPM = int(os.getenv('AI_KEY_TPM', '0'))
+    AI_KEY_QUARANTINE_SECONDS = float(os.getenv('AI_KEY_QUARANTINE_SECONDS', '600'))
+    AI_KEY_COOLDOWN_SECONDS = float(os.getenv('AI_KEY_COOLDOWN_SECONDS', '20'))
     
     # 添加 Flask session 密钥
     SECRET_KEY = os.getenv('SECRET_KEY', os.urandom(24))
@@ -52,4 +61,150 @@ class Config:
         if not cls.API_KEY:
             raise ValueError("API_KEY must be set in .env file")
 
-    PDF_UPLOAD_FOLDER = os.getenv('PDF_UPLOAD_FOLDER', os.path.join(os.getcwd(), 'uploads')) 
\ No newline at end of file
+    PDF_UPLOAD_FOLDER = os.getenv('PDF_UPLOAD_FOLDER', os.path.join(os.getcwd(), 'uploads'))
+
+    # 页面预筛选：在调用AI前跳过空白页、样板页，合并稀疏页
+    PAGE_TRIAGE_ENABLED = os.getenv('PAGE_TRIAGE_ENABLED', 'true').lower() == 'true'
+    PAGE_TRIAGE_MIN_CHARS = int(os.getenv('PAGE_TRIAGE_MIN_CHARS', '20'))
+    PAGE_TRIAGE_SPARSE_CHARS = int(os.getenv('PAGE_TRIAGE_SPARSE_CHARS', '80'))
+    PAGE_TRIAGE_MIN_DENSITY = float(os.getenv('PAGE_TRIAGE_MIN_DENSITY', '0.3'))
+    PAGE_TRIAGE_MAX_BOILERPLATE = float(os.getenv('PAGE_TRIAGE_MAX_BOILERPLATE', '0.8'))
+    # 格式: "类别:动作,..."，类别为 blank/boilerplate/sparse/low_density/normal，
+    # 动作为 process/skip/merge/flag
+    PAGE_TRIAGE_POLICY = os.getenv('PAGE_TRIAGE_POLICY', '')
+
+    # 文本规范化：去除跨页重复的页眉页脚、随页递增的页码，合并断词并压缩空白（保留段落间的空行）
+    TEXT_NORMALIZE_ENABLED = os.getenv('TEXT_NORMALIZE_ENABLED', 'true').lower() == 'true'
+    TEXT_NORMALIZE_EDGE_LINES = int(os.getenv('TEXT_NORMALIZE_EDGE_LINES', '3'))
+    TEXT_NORMALIZE_MIN_REPEAT_RATIO = float(os.getenv('TEXT_NORMALIZE_MIN_REPEAT_RATIO', '0.6'))
+
+    # 本地索引目录（相似页面索引、全文检索索引等）
+    INDEX_FOLDER = os.getenv('INDEX_FOLDER', os.path.join('uploads', 'index'))
+
+    # 跨文档相似页面复用：与使用相同提示处理过的页面足够相似时不再调用API
+    DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+    # offer: 单页处理时返回已有结果由用户选择，批量处理时照常调用API并标注相似来源；
+    # reuse: 不经确认直接复用已有结果（只改了数字的题目也会被判为相似，需自行确认适用）；off: 不查重
+    DEDUP_MODE = os.getenv('DEDUP_MODE', 'offer')
+    DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.9'))
+
+    # 全文检索：两次增量扫描上传目录之间的最小间隔（秒）
+    SEARCH_REFRESH_INTERVAL = int(os.getenv('SEARCH_REFRESH_INTERVAL', '30'))
+
+    # 聊天检索模式：最多引用的页面片段数和参考资料的token预算
+    CHAT_RETRIEVAL_TOP_K = int(os.getenv('CHAT_RETRIEVAL_TOP_K', '5'))
+    CHAT_RETRIEVAL_TOKEN_BUDGET = int(os.getenv('CHAT_RETRIEVAL_TOKEN_BUDGET', '3000'))
+    # 检索时缓存切分结果的PDF文件数上限，超过时淘汰最久未使用的文件
+    CHAT_RETRIEVAL_CACHE_FILES = int(os.getenv('CHAT_RETRIEVAL_CACHE_FILES', '32'))
+
+    # 聊天上下文：原样发送的历史消息token预算，超出部分累计到一定量后压缩为滚动摘要
+    CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv('CHAT_CONTEXT_TOKEN_BUDGET', '2000'))
+    CHAT_SUMMARY_BATCH_TOKENS = int(os.getenv('CHAT_SUMMARY_BATCH_TOKENS', '600'))
+
+    # 整篇文档处理：每块页数、每次合并的结果数、并行处理的块数和中间结果缓存目录
+    DOC_PAGES_PER_CHUNK = int(os.getenv('DOC_PAGES_PER_CHUNK', '5'))
+    DOC_REDUCE_FAN_IN = int(os.getenv('DOC_REDUCE_FAN_IN', '4'))
+    DOC_MAX_WORKERS = int(os.getenv('DOC_MAX_WORKERS', '4'))
+    DOC_CACHE_FOLDER = os.getenv('DOC_CACHE_FOLDER', os.path.join('uploads', 'doc_cache'))
+
+    # 共享文档池：同一PDF在所有会话间只打开一次，最多保留的无会话引用的文档数
+    DOC_POOL_MAX_IDLE = int(os.getenv('DOC_POOL_MAX_IDLE', '8'))
+    # PDF会话闲置超过该时间（秒）后在新会话开始时回收，释放对共享文档的引用
+    PDF_SESSION_TTL_SECONDS = int(os.getenv('PDF_SESSION_TTL_SECONDS', '7200'))
+
+    # 结果文件后台写入：队列上限（写满时处理请求等待）、每批写入的文件数，以及是否fsync
+    OUTPUT_WRITER_MAX_QUEUE = int(os.getenv('OUTPUT_WRITER_MAX_QUEUE', '256'))
+    OUTPUT_WRITER_BATCH_SIZE = int(os.getenv('OUTPUT_WRITER_BATCH_SIZE', '32'))
+    OUTPUT_WRITER_FSYNC = os.getenv('OUTPUT_WRITER_FSYNC', 'true').lower() == 'true'
+
+    # 启动时（python run.py）是否在后台继续被中断的范围处理任务
+    RESUME_ON_STARTUP = os.getenv('RESUME_ON_STARTUP', 'false').lower() == 'true'
+
+    # 性能排查（默认关闭）：启用后请求带 X-Profile: 1 请求头或 ?profile=1 时进行采样分析，
+    # 结果按会话ID保存在 PROFILE_FOLDER；/debug/memory 对比 tracemalloc 快照
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', '0.005'))
+    PROFILING_TRACEMALLOC_FRAMES = int(os.getenv('PROFILING_TRACEMALLOC_FRAMES', '10'))
+    PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', os.path.join('uploads', 'profiles'))
+
+    # 请求追踪（默认关闭）：启用后每页处理中的提取、调度排队、每次上游请求尝试和写盘
+    # 记录为带会话ID和页码的span，以 JSON Lines 追加到 TRACE_FILE，超过 TRACE_MAX_BYTES 时轮转；
+    # 通过 /traces 和 /traces/view 查看
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+    TRACE_FILE = os.getenv('TRACE_FILE', os.path.join('uploads', 'traces', 'spans.jsonl'))
+    TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(20 * 1024 * 1024)))
+
+    # 用户添加的提示模板目录（user_prompts.jsonl，只追加写入，修改后自动重新加载）
+    PROMPTS_FOLDER = os.getenv('PROMPTS_FOLDER', 'prompts')
+
+    # 聊天记录存储目录：按用户追加写入，重启后仍可恢复
+    # 聊天记录按会话 cookie 中的用户ID保存，重启后要找回记录必须设置固定的 SECRET_KEY，
+    # 否则每次启动随机生成，旧 cookie 失效，用户会得到新的ID（启动时会给出警告）
+    CHAT_STORE_FOLDER = os.getenv('CHAT_STORE_FOLDER', os.path.join('uploads', 'chats'))
+
+    # 模型路由：短聊天和摘要用小模型，笔记生成用大模型，max_tokens 按输入长度估算
+    # AI_ROUTE_POLICY 格式为 "任务:档位,..."，任务为 chat/chat_summary/page/document，档位为 fast/large/auto
+    AI_MODEL_FAST = os.getenv('AI_MODEL_FAST', 'claude-3-haiku-20240307')
+    AI_MODEL_LARGE = os.getenv('AI_MODEL_LARGE', 'claude-3-opus-20240229')
+    AI_ROUTE_POLICY = os.getenv('AI_ROUTE_POLICY', '')
+    AI_ROUTE_FAST_INPUT_TOKENS = int(os.getenv('AI_ROUTE_FAST_INPUT_TOKENS', '400'))
+    AI_MAX_TOKENS_CAP = int(os.getenv('AI_MAX_TOKENS_CAP', '4000'))
+
+    # 上游请求调度：同时在途的上游请求上限（同步和异步路径共用），以及只留给交互请求的名额数
+    AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '20'))
+    AI_INTERACTIVE_RESERVE = int(os.getenv('AI_INTERACTIVE_RESERVE', '2'))
+
+    # 请求对冲：请求耗时超过近期延迟分位数时再发一个相同请求，先返回者胜出
+    # DEFAULT_DELAY 在延迟样本不足时使用；BUDGET 为对冲请求数占普通请求数的上限比例
+    # HEDGE_URL/HEDGE_API_KEY 可指定备用端点（两者需同时设置）；留空则发往同一端点，并使用密钥池中的另一个密钥
+    AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'false').lower() == 'true'
+    AI_HEDGE_PERCENTILE = float(os.getenv('AI_HEDGE_PERCENTILE', '0.95'))
+    AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '2'))
+    AI_HEDGE_DEFAULT_DELAY = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', '10'))
+    AI_HEDGE_BUDGET = float(os.getenv('AI_HEDGE_BUDGET', '0.05'))
+    AI_HEDGE_URL = os.getenv('AI_HEDGE_URL', '')
+    AI_HEDGE_API_KEY = os.getenv('AI_HEDGE_API_KEY', '')
+
+    # 熔断：最近 WINDOW 次请求中失败（超时、连接错误、5xx）和慢请求（超过 SLOW_SECONDS）
+    # 的比例达到 FAILURE_RATIO 时熔断，请求直接失败；OPEN_SECONDS 后放行一个探测请求，
+    # 探测请求超过 PROBE_TIMEOUT 仍未结束时放行新的探测
+    AI_CIRCUIT_ENABLED = os.getenv('AI_CIRCUIT_ENABLED', 'true').lower() == 'true'
+    AI_CIRCUIT_FAILURE_RATIO = float(os.getenv('AI_CIRCUIT_FAILURE_RATIO', '0.5'))
+    AI_CIRCUIT_WINDOW = int(os.getenv('AI_CIRCUIT_WINDOW', '20'))
+    AI_CIRCUIT_MIN_REQUESTS = int(os.getenv('AI_CIRCUIT_MIN_REQUESTS', '5'))
+    AI_CIRCUIT_SLOW_SECONDS = float(os.getenv('AI_CIRCUIT_SLOW_SECONDS', '25'))
+    AI_CIRCUIT_OPEN_SECONDS = float(os.getenv('AI_CIRCUIT_OPEN_SECONDS', '30'))
+    AI_CIRCUIT_PROBE_TIMEOUT = float(os.getenv('AI_CIRCUIT_PROBE_TIMEOUT', '60'))
+
+    # 交互处理时的预取：默认预取页数（0为关闭，可由请求的 prefetch 参数覆盖）和上限
+    PREFETCH_PAGES = int(os.getenv('PREFETCH_PAGES', '0'))
+    PREFETCH_MAX_PAGES = int(os.getenv('PREFETCH_MAX_PAGES', '5'))
+
+
+def validate_config(config):
+    """
+    启动时检查配置
+    用途：在 create_app 中调用，配置有误时应用无法启动，而不是在导入 config 时报错
+
+    Args:
+        config: Flask 配置（app.config）
+
+    Raises:
+        ValueError: 列出所有有问题的配置项
+    """
+    problems = []
+    if not config.get('API_KEY'):
+        problems.append("API_KEY must be set in .env file")
+    if config.get('AI_MAX_CONCURRENCY', 1) < 1:
+        problems.append("AI_MAX_CONCURRENCY must be at least 1")
+    if not 0 <= config.get('AI_INTERACTIVE_RESERVE', 0) < config.get('AI_MAX_CONCURRENCY', 1):
+        problems.append("AI_INTERACTIVE_RESERVE must be between 0 and AI_MAX_CONCURRENCY - 1")
+    if config.get('OUTPUT_WRITER_MAX_QUEUE', 1) < 1 or config.get('OUTPUT_WRITER_BATCH_SIZE', 1) < 1:
+        problems.append("OUTPUT_WRITER_MAX_QUEUE and OUTPUT_WRITER_BATCH_SIZE must be at least 1")
+    if config.get('AI_HEDGE_URL') and not config.get('AI_HEDGE_API_KEY'):
+        problems.append("AI_HEDGE_URL requires AI_HEDGE_API_KEY (pool keys are never sent to the hedge endpoint)")
+    if problems:
+        raise ValueError('Invalid configuration: ' + '; '.join(problems))
+    if not os.getenv('SECRET_KEY') and config.get('SECRET_KEY') == Config.SECRET_KEY:
+        logger.warning("SECRET_KEY is not set: a random key is used, so session cookies and "
+                       "chat history (keyed by the cookie's user ID) are lost on every restart")
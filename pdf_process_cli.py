@@ -0,0 +1,265 @@
+import os
+import sys
+import time
+import json
+import argparse
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from app import create_app
+from config import Config
+from app.utils.prompt_manager import PromptManager
+from app.services.pdf_processor import PDFProcessor
+from app.services.ai_processor import AIProcessor
+from app.services.text_normalizer import TextNormalizer
+from app.services.page_triage import PageTriage
+from app.services.output_writer import OutputWriter
+from app.services.scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+
+class BulkStats:
+    """批量处理的计数和token统计（多个线程共同更新）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.pages = 0
+        self.processed = 0
+        self.existing = 0
+        self.skipped = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+class BulkProcessor:
+    """
+    目录批量处理
+    用途：不经过网页，把一个目录下所有PDF的每一页用同一个提示交给AI处理
+
+    流水线：
+    - 提取：主线程逐个文件逐页提取文本并预筛选（跳过空白页、合并稀疏页），
+      已有输出（page_N.md）的页面直接跳过，实现断点续处理
+    - 调用：concurrency 个线程并发调用AI，最多 concurrency * 2 页在途，提取不会远远跑在前面
+    - 写入：结果交给后台写入器批量写盘，不占用调用线程
+
+    输出位置：<输出目录>/<PDF相对输入目录的路径（去掉扩展名）>/page_N.md 和 page_N.json，
+    递归处理时不同子目录下的同名文件不会写到同一位置
+    """
+
+    def __init__(self, app, prompt, input_dir, output_dir, concurrency=4):
+        """
+        初始化批量处理器
+
+        Args:
+            app: Flask应用（提供配置，以及调度、密钥池等共享服务）
+            prompt: 处理提示
+            input_dir: PDF所在目录（输出路径和调度会话按相对该目录的路径区分）
+            output_dir: 输出根目录
+            concurrency: 并发调用AI的页数
+        """
+        self.app = app
+        self.prompt = prompt
+        self.input_dir = Path(input_dir)
+        self.output_dir = Path(output_dir)
+        self.concurrency = concurrency
+        self.stats = BulkStats()
+        self.writer = OutputWriter.from_config(app.config)
+        self.stop_reason = None
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+
+    def _relative(self, pdf_path):
+        """PDF相对输入目录的路径，作为文件的唯一标识"""
+        return pdf_path.relative_to(self.input_dir)
+
+    def _output_path(self, pdf_path, page_number, suffix):
+        parts = [part.replace(' ', '_') for part in self._relative(pdf_path).with_suffix('').parts]
+        return self.output_dir.joinpath(*parts) / f"page_{page_number}.{suffix}"
+
+    def _pages(self, pdf_path):
+        """
+        逐页提取需要处理的文本
+
+        Yields:
+            tuple: (页码, 文本, 合并进来的页码列表)
+        """
+        triage = PageTriage.from_config(self.app.config) if self.app.config.get('PAGE_TRIAGE_ENABLED', True) else None
+        processor = PDFProcessor(str(pdf_path), normalizer=TextNormalizer.from_config(self.app.config))
+        buffer = []
+        try:
+            self.stats.add(files=1, pages=processor.total_pages)
+            for index in range(processor.total_pages):
+                page_number = index + 1
+                if self._output_path(pdf_path, page_number, 'md').exists():
+                    # 已处理过（暂存的稀疏页已包含在该页的结果中）
+                    self.stats.add(existing=1 + len(buffer))
+                    buffer.clear()
+                    continue
+                text = processor.get_page(index)['text']
+                if triage is not None:
+                    action = triage.decide(text, is_last_page=page_number == processor.total_pages)['action']
+                    if action == 'skip':
+                        self.stats.add(skipped=1)
+                        continue
+                    if action == 'merge':
+                        buffer.append((page_number, text))
+                        continue
+                merged = [number for number, _ in buffer]
+                text = '\n\n'.join([t for _, t in buffer] + [text])
+                buffer.clear()
+                yield page_number, text, merged
+        finally:
+            processor.close()
+
+    def _process(self, pdf_path, page_number, text, merged):
+        """调用AI处理一页并提交写入（在线程池中执行）"""
+        try:
+            if self.stop_reason:
+                return
+            with self.app.app_context():
+                response = AIProcessor(priority=BULK, session_key=str(self._relative(pdf_path))).process_text(
+                    text, self.prompt, task='page'
+                )
+            if 'error' in response:
+                self.stats.add(failed=1 + len(merged))
+                logger.error(f"{self._relative(pdf_path)} page {page_number}: {response['error']}")
+                if response.get('unavailable'):
+                    # 上游不可用时停止提交新页面，已完成的结果保留，下次运行从断点继续
+                    self.stop_reason = response['error']
+                return
+
+            usage = response.get('usage', {})
+            self.stats.add(
+                processed=1 + len(merged),
+                prompt_tokens=usage.get('prompt_tokens', 0),
+                completion_tokens=usage.get('completion_tokens', 0)
+            )
+            self.writer.submit(str(self._relative(pdf_path)), str(self._output_path(pdf_path, page_number, 'json')), json.dumps({
+                'source_file': str(pdf_path),
+                'page_number': page_number,
+                'merged_pages': merged,
+                'content': response['content'],
+                'prompt': self.prompt,
+                'model': response.get('model'),
+                'timestamp': response['timestamp'],
+                'usage': usage
+            }, ensure_ascii=False, indent=2))
+            # md 最后写入，它的存在表示该页已完成
+            self.writer.submit(str(self._relative(pdf_path)), str(self._output_path(pdf_path, page_number, 'md')), f"""# {pdf_path.name} 第 {page_number} 页处理结果
+
+## 使用的提示
+```
+{self.prompt}
+```
+
+## 处理结果
+{response['content']}
+""")
+        except Exception as e:
+            self.stats.add(failed=1 + len(merged))
+            logger.error(f"{self._relative(pdf_path)} page {page_number}: {str(e)}")
+        finally:
+            self._slots.release()
+
+    def run(self, pdf_files):
+        """处理所有文件，返回统计"""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                for pdf_path in pdf_files:
+                    logger.info(f"Processing {pdf_path}")
+                    for page_number, text, merged in self._pages(pdf_path):
+                        if self.stop_reason:
+                            break
+                        self._slots.acquire()
+                        executor.submit(self._process, pdf_path, page_number, text, merged)
+                    if self.stop_reason:
+                        break
+            except KeyboardInterrupt:
+                # 排队中的页面不再调用AI，只等待正在调用的页面结束
+                self.stop_reason = 'cancelled'
+                raise
+            finally:
+                executor.shutdown(wait=True)
+                self.writer.close()
+        return self.stats
+
+
+def find_pdfs(input_dir, recursive=False):
+    """列出目录下的PDF文件（按路径排序）"""
+    pattern = '**/*.pdf' if recursive else '*.pdf'
+    return sorted(p for p in Path(input_dir).glob(pattern) if p.is_file())
+
+
+def print_report(stats, elapsed, writer_stats):
+    """打印吞吐量和token统计"""
+    total_tokens = stats.prompt_tokens + stats.completion_tokens
+    print("\n" + "=" * 50)
+    print(f"文件数:         {stats.files}")
+    print(f"总页数:         {stats.pages}")
+    print(f"本次处理:       {stats.processed} 页")
+    print(f"已有结果跳过:   {stats.existing} 页")
+    print(f"预筛选跳过:     {stats.skipped} 页")
+    print(f"失败:           {stats.failed} 页")
+    print(f"耗时:           {elapsed:.1f} 秒")
+    print(f"吞吐量:         {stats.processed / elapsed if elapsed else 0:.2f} 页/秒")
+    print(f"输入tokens:     {stats.prompt_tokens}")
+    print(f"输出tokens:     {stats.completion_tokens}")
+    print(f"总tokens:       {total_tokens} ({total_tokens / elapsed if elapsed else 0:.0f} tokens/秒)")
+    print(f"写入文件:       {writer_stats['written']}（失败 {writer_stats['failed']}）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量用AI处理目录下所有PDF（无交互，可断点续处理）')
+    parser.add_argument('input_dir', nargs='?', help='PDF所在目录')
+    parser.add_argument('-p', '--prompt-id', type=int, help='提示ID（内置提示和网页中添加的提示，见 --list-prompts）')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='并发处理的页数（默认4）')
+    parser.add_argument('-o', '--output', help='输出目录（默认为 <input_dir>/ai_outputs）')
+    parser.add_argument('-r', '--recursive', action='store_true', help='包含子目录中的PDF')
+    parser.add_argument('--list-prompts', action='store_true', help='列出可用的提示后退出')
+    args = parser.parse_args()
+
+    prompt_manager = PromptManager(Config.PROMPTS_FOLDER)
+    if args.list_prompts:
+        for prompt in prompt_manager.get_all_prompts():
+            print(f"{prompt['id']}: {prompt['name']} - {prompt['description']}")
+        return 0
+    if not args.input_dir or args.prompt_id is None:
+        parser.error('需要提供 input_dir 和 --prompt-id')
+
+    prompt = prompt_manager.get_prompt_by_id(args.prompt_id)
+    if prompt is None:
+        parser.error(f"未找到提示ID {args.prompt_id}，可用 --list-prompts 查看")
+    pdf_files = find_pdfs(args.input_dir, args.recursive)
+    if not pdf_files:
+        print(f"{args.input_dir} 下没有找到PDF文件")
+        return 1
+
+    output_dir = args.output or os.path.join(args.input_dir, 'ai_outputs')
+    print(f"处理 {len(pdf_files)} 个文件，提示：{prompt['name']}，并发：{args.concurrency}，输出：{output_dir}")
+
+    app = create_app()
+    bulk = BulkProcessor(app, prompt['prompt'], args.input_dir, output_dir, concurrency=max(args.concurrency, 1))
+    started = time.time()
+    try:
+        stats = bulk.run(pdf_files)
+    except KeyboardInterrupt:
+        # 已提交的结果写完再退出，下次运行从断点继续
+        print("\n操作已取消，已完成的结果已保存")
+        stats = bulk.stats
+    print_report(stats, time.time() - started, bulk.writer.stats())
+    if bulk.stop_reason:
+        print(f"\n处理提前停止：{bulk.stop_reason}。重新运行同一命令即可从断点继续")
+        return 1
+    return 1 if stats.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,6 @@
+from werkzeug.serving import is_running_from_reloader
 from app import create_app
+from app.routes.pdf import resume_incomplete_jobs
 
 # 创建Flask应用实例
 # create_app函数在app/__init__.py中定义
@@ -17,5 +19,10 @@ if __name__ == '__main__':
     - 启用调试模式
     - 代码修改后自动重载
     - 详细的错误页面
+    - 多线程处理请求（同一PDF会话的请求由会话锁串行化）
+    - RESUME_ON_STARTUP 为真时继续被中断的范围处理任务
+      （自动重载会启动两个进程，只在实际处理请求的子进程中恢复）
     """
-    app.run(debug=True) 
\ No newline at end of file
+    if app.config.get('RESUME_ON_STARTUP') and is_running_from_reloader():
+        resume_incomplete_jobs(app)
+    app.run(debug=True, threaded=True) 
\ No newline at end of file